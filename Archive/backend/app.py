@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Backend entrypoint for Smart Document QA Agent
+Registers either the simple or the full QA engine API based on QA_BACKEND
+"""
+import os
+import sys
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from flask_cors import CORS
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+try:
+    from config import ALLOWED_ORIGINS
+except ImportError:
+    ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:8501,http://127.0.0.1:8501").split(",")
+
+BACKEND_OLD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend_old')
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster response serialization"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def create_app(backend=None):
+    """Create the Flask app with the 'simple' or 'full' API blueprint"""
+    backend = backend or os.getenv('QA_BACKEND', 'simple')
+    
+    # Only the selected backend's module is imported
+    if backend == 'full':
+        sys.path.append(BACKEND_OLD_DIR)
+        from api import api_bp as blueprint
+    elif backend == 'simple':
+        from simple_api import simple_bp as blueprint
+    else:
+        raise ValueError(f"Unknown QA_BACKEND '{backend}', expected 'simple' or 'full'")
+    
+    app = Flask(__name__)
+    if ORJSON_AVAILABLE:
+        app.json = ORJSONProvider(app)
+    
+    # Only the browser-facing routes need CORS; health checks skip it entirely
+    CORS(app, resources={
+        r"/api/ask": {"origins": ALLOWED_ORIGINS},
+        r"/api/documents*": {"origins": ALLOWED_ORIGINS},
+    })
+    
+    app.register_blueprint(blueprint)
+    return app
+
+if __name__ == '__main__':
+    create_app().run(debug=False, host='0.0.0.0', port=5000, threaded=True)
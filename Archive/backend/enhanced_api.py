@@ -13,7 +13,7 @@ import json
 
 # Import enhanced modules
 from enhanced_qa_engine import EnhancedQAEngine
-from voice_processor import VoiceProcessor
+from voice_processor import VoiceProcessor, TTS_OUTPUT_FORMATS
 from google_drive_manager import GoogleDriveManager
 from config import GOOGLE_AI_API_KEY, MAX_FILE_SIZE_MB, SUPPORTED_FILE_TYPES
 
@@ -205,6 +205,9 @@ def text_to_speech():
         if not text:
             return jsonify({'success': False, 'error': 'No text provided'}), 400
         
+        if output_format not in TTS_OUTPUT_FORMATS:
+            return jsonify({'success': False, 'error': f'Unsupported audio format: {output_format}'}), 400
+        
         # Generate speech
         audio_data = voice_processor.text_to_speech(text, output_format)
         
@@ -212,7 +215,7 @@ def text_to_speech():
             # Return audio file
             return send_file(
                 io.BytesIO(audio_data),
-                mimetype=f'audio/{output_format}',
+                mimetype='audio/mpeg' if output_format == 'mp3' else f'audio/{output_format}',
                 as_attachment=True,
                 download_name=f'speech.{output_format}'
             )
@@ -352,6 +355,21 @@ def get_capabilities():
         logger.error(f"Error getting capabilities: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """Get statistics, capabilities and documents in one response"""
+    try:
+        return jsonify({
+            'success': True,
+            'status': 'healthy',
+            'stats': qa_engine.get_database_stats(),
+            'capabilities': qa_engine.get_capabilities(),
+            'documents': qa_engine.list_documents()
+        })
+    except Exception as e:
+        logger.error(f"Error getting dashboard: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/search', methods=['POST'])
 def search_documents():
     """Search for relevant document chunks"""
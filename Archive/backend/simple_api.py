@@ -1,23 +1,118 @@
 """
 Simple Backend API - Works without complex dependencies
 """
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Blueprint, current_app, request, jsonify
 import os
+import re
+import mmap
+import itertools
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import PyPDF2
 import docx
 from datetime import datetime
 import json
 
-app = Flask(__name__)
-CORS(app)
+try:
+    from config import MAX_CONCURRENT_UPLOADS
+except ImportError:
+    MAX_CONCURRENT_UPLOADS = 3
+
+simple_bp = Blueprint('simple', __name__)
 
 # Simple in-memory storage
 documents_db = []
 conversation_history = []
 
-@app.route('/api/health', methods=['GET'])
+# Document ids are never reused: they name the content file on disk, and a
+# background ingest for a deleted document may still be writing its file
+_document_ids = itertools.count(max((doc['document_id'] for doc in documents_db), default=0) + 1)
+
+# Extracted text lives on disk and is memory-mapped, keyed by document_id,
+# so workers share it through the OS page cache instead of holding str copies
+CONTENT_FOLDER = os.getenv("SIMPLE_API_CONTENT_FOLDER", "./uploads")
+os.makedirs(CONTENT_FOLDER, exist_ok=True)
+document_contents = {}
+
+def _close_mapping(content):
+    """Unmap a document, unless a search still holds it; it is then unmapped once released"""
+    try:
+        content.close()
+    except BufferError:
+        pass
+
+def _store_document_content(document_id, text):
+    """Write extracted text to disk and map it read-only"""
+    content_path = os.path.join(CONTENT_FOLDER, f'{document_id}.txt')
+    data = text.encode('utf-8')
+    
+    # Windows refuses to rewrite a file that is still mapped
+    previous = document_contents.pop(document_id, None)
+    if isinstance(previous, mmap.mmap):
+        _close_mapping(previous)
+    
+    with open(content_path, 'wb') as content_file:
+        content_file.write(data)
+    
+    if data:
+        with open(content_path, 'rb') as content_file:
+            document_contents[document_id] = mmap.mmap(content_file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        # Zero-length files cannot be mapped
+        document_contents[document_id] = b''
+
+def _discard_document_content(document_id):
+    """Unmap and delete a document's extracted text"""
+    content = document_contents.pop(document_id, None)
+    if isinstance(content, mmap.mmap):
+        _close_mapping(content)
+    content_path = os.path.join(CONTENT_FOLDER, f'{document_id}.txt')
+    if os.path.exists(content_path):
+        os.unlink(content_path)
+
+def _document_content(document_id):
+    """A document's extracted UTF-8 text as a read-only buffer, searched without copying"""
+    return document_contents.get(document_id, b'')
+
+# Uploads are extracted in the background so requests return immediately
+_extraction_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS)
+
+# Bumped on every upload/delete; used as the ETag for read-only endpoints.
+# Background ingest threads bump it too, so the version and cache share a lock
+documents_db_version = 0
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+def _bump_documents_version():
+    """Invalidate cached GET responses after documents_db changes"""
+    global documents_db_version
+    with _response_cache_lock:
+        documents_db_version += 1
+        _response_cache.clear()
+
+def _cached_json_response(endpoint, build_payload):
+    """Serve a JSON payload with an ETag, returning 304 when the client is current"""
+    with _response_cache_lock:
+        version = documents_db_version
+        body = _response_cache.get(endpoint)
+    etag = f'"{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = current_app.response_class(status=304)
+    else:
+        if body is None:
+            body = current_app.json.dumps(build_payload())
+            # A body built while documents_db changed may be stale; serve it once but don't cache it
+            with _response_cache_lock:
+                if documents_db_version == version:
+                    _response_cache[endpoint] = body
+        response = current_app.response_class(body, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, must-revalidate'
+    return response
+
+@simple_bp.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
@@ -27,15 +122,15 @@ def health_check():
         'features': ['text_qa', 'document_upload', 'pdf_support', 'docx_support']
     })
 
-@app.route('/api/documents', methods=['GET'])
+@simple_bp.route('/api/documents', methods=['GET'])
 def list_documents():
     """List all documents"""
     try:
-        return jsonify({'success': True, 'documents': documents_db})
+        return _cached_json_response('documents', lambda: {'success': True, 'documents': documents_db})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/documents', methods=['POST'])
+@simple_bp.route('/api/documents', methods=['POST'])
 def add_document():
     """Add a document"""
     try:
@@ -46,50 +141,90 @@ def add_document():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        # Extract text based on file type
         file_ext = os.path.splitext(file.filename)[1].lower()
-        
-        if file_ext == '.pdf':
-            text = extract_pdf_text(file)
-        elif file_ext == '.txt':
-            text = file.read().decode('utf-8')
-        elif file_ext in ['.docx', '.doc']:
-            text = extract_docx_text(file)
-        else:
+        if file_ext not in ['.pdf', '.txt', '.docx', '.doc']:
             return jsonify({'success': False, 'error': f'Unsupported file type: {file_ext}'}), 400
         
         # Create document record
         document = {
-            'document_id': len(documents_db) + 1,
+            'document_id': next(_document_ids),
             'file_name': file.filename,
             'file_type': file_ext,
-            'content': text,
-            'word_count': len(text.split()),
+            'word_count': 0,
+            'status': 'processing',
             'added_at': datetime.now().isoformat()
         }
         
+        # Persist the raw upload and extract it off the request thread
+        source_path = os.path.join(CONTENT_FOLDER, f"{document['document_id']}_source{file_ext}")
+        file.save(source_path)
         documents_db.append(document)
+        _bump_documents_version()
+        _extraction_executor.submit(_ingest_document, document, source_path)
         
         return jsonify({
             'success': True,
             'document_id': document['document_id'],
             'file_name': file.filename,
-            'word_count': document['word_count'],
-            'message': f"Document '{file.filename}' added successfully"
-        })
+            'status': document['status'],
+            'status_url': f"/api/documents/{document['document_id']}/status",
+            'message': f"Document '{file.filename}' accepted for processing"
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def extract_pdf_text(file):
-    """Extract text from PDF"""
+@simple_bp.route('/api/documents/<int:document_id>/status', methods=['GET'])
+def get_document_status(document_id):
+    """Get the processing status of an uploaded document"""
+    for doc in documents_db:
+        if doc['document_id'] == document_id:
+            return jsonify({
+                'success': True,
+                'document_id': document_id,
+                'status': doc['status'],
+                'word_count': doc['word_count'],
+                'error': doc.get('error')
+            })
+    return jsonify({'success': False, 'error': f'Document {document_id} not found'}), 404
+
+def _ingest_document(document, source_path):
+    """Extract an uploaded file's text and mark the document ready"""
+    try:
+        with open(source_path, 'rb') as source_file:
+            if document['file_type'] == '.pdf':
+                text = extract_pdf_text(source_file)
+            elif document['file_type'] == '.txt':
+                text = source_file.read().decode('utf-8')
+            else:
+                text = extract_docx_text(source_file)
+        
+        _store_document_content(document['document_id'], text)
+        document['word_count'] = len(text.split())
+        document['status'] = 'ready'
+        
+        # The document may have been deleted while it was being processed
+        if document not in documents_db:
+            _discard_document_content(document['document_id'])
+    except Exception as e:
+        document['status'] = 'failed'
+        document['error'] = str(e)
+    finally:
+        if os.path.exists(source_path):
+            os.unlink(source_path)
+        _bump_documents_version()
+
+def _iter_pdf_pages(pdf_reader, start_page=0):
+    """Yield page texts lazily so callers can stop early"""
+    for page in itertools.islice(pdf_reader.pages, start_page, None):
+        yield (page.extract_text() or "") + "\n"
+
+def extract_pdf_text(file, max_pages=None, start_page=0):
+    """Extract text from PDF, optionally limited to a range of pages"""
     try:
         file.seek(0)
         pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return "".join(itertools.islice(_iter_pdf_pages(pdf_reader, start_page), max_pages))
     except Exception as e:
         return f"Error extracting PDF: {str(e)}"
 
@@ -105,7 +240,27 @@ def extract_docx_text(file):
     except Exception as e:
         return f"Error extracting DOCX: {str(e)}"
 
-@app.route('/api/ask', methods=['POST'])
+# Only this many matching sentences are returned as sources
+MAX_ANSWER_SOURCES = 3
+
+def _case_insensitive_bytes(text):
+    """UTF-8 regex source matching text with every letter in either case"""
+    parts = []
+    for char in text:
+        variants = {variant.encode('utf-8') for variant in (char, char.lower(), char.upper()) if len(variant) == 1}
+        alternatives = sorted(re.escape(variant) for variant in variants)
+        parts.append(alternatives[0] if len(alternatives) == 1 else b'(?:' + b'|'.join(alternatives) + b')')
+    return b''.join(parts)
+
+@lru_cache(maxsize=256)
+def _sentence_pattern(question):
+    """Compile a bytes pattern matching whole '.'-delimited sentences that contain the question"""
+    # Runs straight over the mapped UTF-8 ('.' never occurs inside a multi-byte character);
+    # letters are spelled out in both cases because bytes IGNORECASE only folds ASCII.
+    # The lookbehind pins each match to a sentence start, keeping the scan linear
+    return re.compile(rb'(?<![^.])[^.]*' + _case_insensitive_bytes(question) + rb'[^.]*')
+
+@simple_bp.route('/api/ask', methods=['POST'])
 def ask_question():
     """Ask a question"""
     try:
@@ -121,23 +276,25 @@ def ask_question():
                 'message': 'No documents found. Please upload some documents first.'
             })
         
-        # Simple text search
+        # Simple text search: one regex pass over each mapped document pulls out the
+        # sentences containing the question; all are counted, the first few decoded and returned
         results = []
+        match_count = 0
+        sentence_pattern = _sentence_pattern(question)
         for doc in documents_db:
-            if question.lower() in doc['content'].lower():
-                # Find relevant sentences
-                sentences = doc['content'].split('.')
-                for sentence in sentences:
-                    if question.lower() in sentence.lower():
-                        results.append({
-                            'document_name': doc['file_name'],
-                            'similarity': 0.8,
-                            'chunk_preview': sentence.strip()[:200] + "..." if len(sentence.strip()) > 200 else sentence.strip()
-                        })
+            for match in sentence_pattern.finditer(_document_content(doc['document_id'])):
+                match_count += 1
+                if len(results) < MAX_ANSWER_SOURCES:
+                    sentence = match.group(0).decode('utf-8', errors='ignore').strip()
+                    results.append({
+                        'document_name': doc['file_name'],
+                        'similarity': 0.8,
+                        'chunk_preview': sentence[:200] + "..." if len(sentence) > 200 else sentence
+                    })
         
         if results:
-            answer = f"Based on your documents, I found {len(results)} relevant sections about '{question}'. Here's what I found:\n\n"
-            for i, result in enumerate(results[:3], 1):
+            answer = f"Based on your documents, I found {match_count} relevant sections about '{question}'. Here's what I found:\n\n"
+            for i, result in enumerate(results, 1):
                 answer += f"{i}. From {result['document_name']}:\n{result['chunk_preview']}\n\n"
         else:
             answer = f"I couldn't find specific information about '{question}' in your documents. Try rephrasing your question or upload more relevant documents."
@@ -147,40 +304,41 @@ def ask_question():
             'question': question,
             'answer': answer,
             'timestamp': datetime.now().isoformat(),
-            'sources': results[:3]
+            'sources': results
         })
         
         return jsonify({
             'success': True,
             'question': question,
             'answer': answer,
-            'sources': results[:3],
+            'sources': results,
             'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/documents/<int:document_id>', methods=['DELETE'])
+@simple_bp.route('/api/documents/<int:document_id>', methods=['DELETE'])
 def remove_document(document_id):
     """Remove a document"""
     try:
         global documents_db
         documents_db = [doc for doc in documents_db if doc['document_id'] != document_id]
+        _discard_document_content(document_id)
+        _bump_documents_version()
         return jsonify({'success': True, 'message': f'Document {document_id} removed successfully'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/stats', methods=['GET'])
+@simple_bp.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get database statistics"""
     try:
-        total_words = sum(doc['word_count'] for doc in documents_db)
-        return jsonify({
+        return _cached_json_response('stats', lambda: {
             'success': True,
             'stats': {
                 'document_count': len(documents_db),
-                'total_words': total_words,
+                'total_words': sum(doc['word_count'] for doc in documents_db),
                 'total_chunks': len(documents_db),
                 'total_size_mb': 0.1  # Approximate
             }
@@ -188,10 +346,10 @@ def get_stats():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/capabilities', methods=['GET'])
+@simple_bp.route('/api/capabilities', methods=['GET'])
 def get_capabilities():
     """Get system capabilities"""
-    return jsonify({
+    return _cached_json_response('capabilities', lambda: {
         'success': True,
         'capabilities': {
             'document_processing': {
@@ -221,9 +379,11 @@ def get_capabilities():
     })
 
 if __name__ == '__main__':
+    from app import create_app
+    
     print("🚀 Starting Simple QA Agent Backend...")
     print("📄 Supported: PDF, TXT, DOCX files")
     print("🌐 Server: http://localhost:5000")
     print("📖 Health: http://localhost:5000/api/health")
     
-    app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)
+    create_app('simple').run(debug=False, host='0.0.0.0', port=5000, threaded=True)
@@ -4,7 +4,9 @@ Voice processing module for speech-to-text and text-to-speech functionality
 import io
 import tempfile
 import logging
-from typing import Dict, Any, Optional, Union
+import threading
+import wave
+from typing import List, Dict, Any, Optional, Union
 import os
 from datetime import datetime
 
@@ -23,15 +25,25 @@ except ImportError:
     TTS_ENGINE_AVAILABLE = False
     pyttsx3 = None
 
+try:
+    from piper.voice import PiperVoice
+    PIPER_AVAILABLE = True
+except ImportError:
+    PIPER_AVAILABLE = False
+    PiperVoice = None
+
 # Configuration
 from config import (
     VOICE_CHAT_ENABLED, SPEECH_RECOGNITION_TIMEOUT, SPEECH_RECOGNITION_PHRASE_TIMEOUT,
-    TEXT_TO_SPEECH_ENABLED, TEXT_TO_SPEECH_VOICE, AUDIO_SAMPLE_RATE, AUDIO_CHUNK_SIZE,
-    AUDIO_MAX_DURATION_SECONDS, FEATURES
+    TEXT_TO_SPEECH_ENABLED, TEXT_TO_SPEECH_VOICE, PIPER_VOICE_MODEL_PATH, AUDIO_SAMPLE_RATE,
+    AUDIO_CHUNK_SIZE, AUDIO_MAX_DURATION_SECONDS, FEATURES
 )
 
 logger = logging.getLogger(__name__)
 
+# Formats text_to_speech can return; anything but WAV is transcoded with pydub
+TTS_OUTPUT_FORMATS = ('wav', 'mp3', 'ogg')
+
 class VoiceProcessor:
     """
     Handles voice input and output processing
@@ -40,6 +52,9 @@ class VoiceProcessor:
     def __init__(self):
         self.speech_recognizer = sr.Recognizer()
         self.tts_engine = None
+        self.piper_voice = None
+        # pyttsx3's runAndWait loop is not re-entrant
+        self._tts_lock = threading.Lock()
         
         # Configure speech recognition
         self.speech_recognizer.energy_threshold = 300
@@ -48,8 +63,29 @@ class VoiceProcessor:
         self.speech_recognizer.operation_timeout = SPEECH_RECOGNITION_TIMEOUT
         self.speech_recognizer.phrase_timeout = SPEECH_RECOGNITION_PHRASE_TIMEOUT
         
-        # Initialize text-to-speech engine
-        if FEATURES.get('voice_chat', False) and TEXT_TO_SPEECH_ENABLED and TTS_ENGINE_AVAILABLE:
+        tts_enabled = FEATURES.get('voice_chat', False) and TEXT_TO_SPEECH_ENABLED
+        
+        # Prefer Piper: ONNX inference runs in-process and handles concurrent callers
+        if tts_enabled and PIPER_AVAILABLE and PIPER_VOICE_MODEL_PATH and os.path.exists(PIPER_VOICE_MODEL_PATH):
+            try:
+                self.piper_voice = PiperVoice.load(PIPER_VOICE_MODEL_PATH)
+                logger.info("Piper text-to-speech voice loaded successfully")
+            except Exception as e:
+                logger.warning(f"Failed to load Piper voice model: {e}")
+                self.piper_voice = None
+        
+        # Initialize text-to-speech engine; with Piper loaded it is only started as a fallback
+        self._tts_enabled = tts_enabled
+        if self.piper_voice is None:
+            self._init_tts_engine()
+    
+    def _init_tts_engine(self) -> bool:
+        """Start the pyttsx3 engine if it is enabled and not running yet"""
+        if not (self._tts_enabled and TTS_ENGINE_AVAILABLE):
+            return False
+        with self._tts_lock:
+            if self.tts_engine is not None:
+                return True
             try:
                 self.tts_engine = pyttsx3.init()
                 self._configure_tts_engine()
@@ -57,6 +93,7 @@ class VoiceProcessor:
             except Exception as e:
                 logger.warning(f"Failed to initialize text-to-speech engine: {e}")
                 self.tts_engine = None
+            return self.tts_engine is not None
     
     def _configure_tts_engine(self):
         """Configure text-to-speech engine settings"""
@@ -108,21 +145,16 @@ class VoiceProcessor:
         try:
             # Handle different input types
             if isinstance(audio_data, str):
-                # File path
-                audio_file = audio_data
+                # File path - pydub infers the format from the extension
+                audio_source = audio_data
+                source_format = None
             else:
-                # Bytes data - save to temporary file
-                with tempfile.NamedTemporaryFile(suffix=f'.{audio_format}', delete=False) as tmp_file:
-                    tmp_file.write(audio_data)
-                    audio_file = tmp_file.name
+                # Bytes data - wrap in memory
+                audio_source = io.BytesIO(audio_data)
+                source_format = audio_format
             
-            try:
-                # Process audio file
-                return self._transcribe_audio_file(audio_file)
-            finally:
-                # Clean up temporary file if we created one
-                if isinstance(audio_data, bytes) and os.path.exists(audio_file):
-                    os.unlink(audio_file)
+            # Process audio
+            return self._transcribe_audio_file(audio_source, source_format)
                     
         except Exception as e:
             logger.error(f"Error processing voice input: {e}")
@@ -133,29 +165,24 @@ class VoiceProcessor:
                 'confidence': 0.0
             }
     
-    def _transcribe_audio_file(self, audio_file_path: str) -> Dict[str, Any]:
-        """Transcribe audio file to text"""
+    def _transcribe_audio_file(self, audio_source: Union[str, io.BytesIO],
+                               audio_format: Optional[str] = None) -> Dict[str, Any]:
+        """Transcribe an audio file path or in-memory buffer to text"""
         try:
             # Preprocess audio for better recognition
-            processed_audio_file = self._preprocess_audio(audio_file_path)
+            processed_audio = self._preprocess_audio(audio_source, audio_format)
             
             # Perform speech recognition
-            with sr.AudioFile(processed_audio_file) as source:
+            with sr.AudioFile(processed_audio) as source:
                 # Adjust for ambient noise
                 self.speech_recognizer.adjust_for_ambient_noise(source, duration=0.5)
                 audio_data = self.speech_recognizer.record(source)
             
             # Try multiple recognition engines
-            transcription_result = self._recognize_speech_multiple_engines(audio_data)
-            
-            # Clean up processed audio file
-            if processed_audio_file != audio_file_path and os.path.exists(processed_audio_file):
-                os.unlink(processed_audio_file)
-            
-            return transcription_result
+            return self._recognize_speech_multiple_engines(audio_data)
             
         except Exception as e:
-            logger.error(f"Error transcribing audio file {audio_file_path}: {e}")
+            logger.error(f"Error transcribing audio {getattr(audio_source, 'name', audio_source)}: {e}")
             return {
                 'success': False,
                 'error': str(e),
@@ -163,11 +190,12 @@ class VoiceProcessor:
                 'confidence': 0.0
             }
     
-    def _preprocess_audio(self, audio_file_path: str) -> str:
-        """Preprocess audio for better speech recognition"""
+    def _preprocess_audio(self, audio_source: Union[str, io.BytesIO],
+                          audio_format: Optional[str] = None) -> Union[str, io.BytesIO]:
+        """Preprocess audio for better speech recognition, returning a WAV buffer"""
         try:
-            # Load audio
-            audio = AudioSegment.from_file(audio_file_path)
+            # Load audio; file objects carry no extension, so the format is passed explicitly
+            audio = AudioSegment.from_file(audio_source, format=audio_format)
             
             # Check duration
             duration_seconds = len(audio) / 1000
@@ -189,15 +217,19 @@ class VoiceProcessor:
             # Apply noise reduction (simple high-pass filter)
             audio = audio.high_pass_filter(200)
             
-            # Save processed audio
-            processed_file_path = audio_file_path.replace('.', '_processed.')
-            audio.export(processed_file_path, format='wav')
+            # Export processed audio to memory
+            processed_audio = io.BytesIO()
+            audio.export(processed_audio, format='wav')
+            processed_audio.seek(0)
             
-            return processed_file_path
+            return processed_audio
             
         except Exception as e:
             logger.warning(f"Error preprocessing audio: {e}")
-            return audio_file_path  # Return original if preprocessing fails
+            # Return original if preprocessing fails
+            if hasattr(audio_source, 'seek'):
+                audio_source.seek(0)
+            return audio_source
     
     def _recognize_speech_multiple_engines(self, audio_data) -> Dict[str, Any]:
         """Try multiple speech recognition engines"""
@@ -256,15 +288,25 @@ class VoiceProcessor:
         
         Args:
             text: Text to convert to speech
-            output_format: Output audio format (wav, mp3)
+            output_format: Output audio format, one of TTS_OUTPUT_FORMATS
             
         Returns:
             Audio data as bytes or None if failed
         """
-        if not FEATURES.get('voice_chat', False) or not self.tts_engine:
+        if output_format not in TTS_OUTPUT_FORMATS:
+            logger.warning(f"Unsupported text-to-speech format: {output_format}")
+            return None
+        
+        if not FEATURES.get('voice_chat', False) or not (self.piper_voice or self.tts_engine):
             logger.warning("Text-to-speech is not available")
             return None
         
+        if self.piper_voice is not None:
+            audio_data = self._synthesize_with_piper(text, output_format)
+            if audio_data is not None or not self._init_tts_engine():
+                return audio_data
+            logger.info("Falling back to pyttsx3 text-to-speech")
+        
         try:
             # Create temporary file for audio output
             with tempfile.NamedTemporaryFile(suffix=f'.{output_format}', delete=False) as tmp_file:
@@ -272,10 +314,13 @@ class VoiceProcessor:
             
             try:
                 # Generate speech
-                self.tts_engine.save_to_file(text, tmp_file_path)
-                self.tts_engine.runAndWait()
+                with self._tts_lock:
+                    self.tts_engine.save_to_file(text, tmp_file_path)
+                    self.tts_engine.runAndWait()
                 
-                # Read the generated audio file
+                # Read the generated audio file; the engine writes WAV whatever the suffix
+                if output_format != 'wav':
+                    return self._transcode_audio(tmp_file_path, output_format)
                 with open(tmp_file_path, 'rb') as audio_file:
                     audio_data = audio_file.read()
                 
@@ -290,13 +335,36 @@ class VoiceProcessor:
             logger.error(f"Error in text-to-speech: {e}")
             return None
     
+    def _synthesize_with_piper(self, text: str, output_format: str = 'wav') -> Optional[bytes]:
+        """Synthesize audio in memory with the loaded Piper voice"""
+        try:
+            audio_buffer = io.BytesIO()
+            with wave.open(audio_buffer, 'wb') as wav_file:
+                # piper-tts 1.3 moved WAV output to synthesize_wav; synthesize now yields audio chunks
+                synthesize_wav = getattr(self.piper_voice, 'synthesize_wav', None) or self.piper_voice.synthesize
+                synthesize_wav(text, wav_file)
+            if output_format != 'wav':
+                audio_buffer.seek(0)
+                return self._transcode_audio(audio_buffer, output_format)
+            return audio_buffer.getvalue()
+        except Exception as e:
+            logger.error(f"Error in Piper text-to-speech: {e}")
+            return None
+    
+    def _transcode_audio(self, wav_source: Union[str, io.BytesIO], output_format: str) -> bytes:
+        """Re-encode WAV audio from a path or buffer into output_format"""
+        output = io.BytesIO()
+        AudioSegment.from_file(wav_source, format='wav').export(output, format=output_format)
+        return output.getvalue()
+    
     def get_voice_capabilities(self) -> Dict[str, Any]:
         """Get information about voice processing capabilities"""
         return {
             'voice_chat_enabled': FEATURES.get('voice_chat', False),
             'speech_recognition_available': True,
-            'text_to_speech_available': self.tts_engine is not None,
+            'text_to_speech_available': self.piper_voice is not None or self.tts_engine is not None,
             'tts_engine_available': TTS_ENGINE_AVAILABLE,
+            'piper_voice_loaded': self.piper_voice is not None,
             'supported_audio_formats': ['wav', 'mp3', 'm4a', 'aac', 'ogg', 'flac'],
             'max_audio_duration_seconds': AUDIO_MAX_DURATION_SECONDS,
             'default_sample_rate': AUDIO_SAMPLE_RATE,
@@ -2,25 +2,29 @@
 """
 Backend API for Smart Document QA Agent
 """
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Blueprint, request, jsonify
 import os
 import tempfile
-from qa_engine import QAEngine
-from config import GOOGLE_AI_API_KEY
 
-app = Flask(__name__)
-CORS(app)
+api_bp = Blueprint('full', __name__)
 
-# Initialize QA Engine
-qa_engine = QAEngine(api_key=GOOGLE_AI_API_KEY)
+# Created when the blueprint is registered, so importing this module stays cheap
+qa_engine = None
 
-@app.route('/api/health', methods=['GET'])
+@api_bp.record_once
+def init_qa_engine(state):
+    """Initialize the QA Engine the first time the blueprint is registered"""
+    global qa_engine
+    from qa_engine import QAEngine
+    from config import GOOGLE_AI_API_KEY
+    qa_engine = QAEngine(api_key=GOOGLE_AI_API_KEY)
+
+@api_bp.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'QA Agent Backend is running'})
 
-@app.route('/api/documents', methods=['GET'])
+@api_bp.route('/api/documents', methods=['GET'])
 def list_documents():
     """List all documents"""
     try:
@@ -31,7 +35,7 @@ def list_documents():
 
 MAX_FILE_BYTES = 200 * 1024 * 1024  # 200 MB limit
 
-@app.route('/api/documents', methods=['POST'])
+@api_bp.route('/api/documents', methods=['POST'])
 def add_document():
     """Add a document"""
     try:
@@ -58,7 +62,7 @@ def add_document():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/documents/<document_id>', methods=['DELETE'])
+@api_bp.route('/api/documents/<document_id>', methods=['DELETE'])
 def remove_document(document_id):
     """Remove a document"""
     try:
@@ -67,7 +71,7 @@ def remove_document(document_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/ask', methods=['POST'])
+@api_bp.route('/api/ask', methods=['POST'])
 def ask_question():
     """Ask a question"""
     try:
@@ -82,7 +86,7 @@ def ask_question():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/stats', methods=['GET'])
+@api_bp.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get database statistics"""
     try:
@@ -92,4 +96,10 @@ def get_stats():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 if __name__ == '__main__':
+    from flask import Flask
+    from flask_cors import CORS
+    
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api_bp)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -53,11 +53,15 @@ SPEECH_RECOGNITION_TIMEOUT = 5
 SPEECH_RECOGNITION_PHRASE_TIMEOUT = 1
 TEXT_TO_SPEECH_ENABLED = True
 TEXT_TO_SPEECH_VOICE = "en-US-Standard-C"
+PIPER_VOICE_MODEL_PATH = os.getenv("PIPER_VOICE_MODEL_PATH", "")  # Piper .onnx voice; falls back to pyttsx3
 
 # Vector Database Settings
 VECTOR_DB_PATH = "./vector_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Lightweight sentence transformer
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")  # "onnx" or "torch"
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")  # int8 export; "" for fp32 model.onnx
 TOP_K_RESULTS = 5
+MAX_CONTEXT_TOKENS = 4000  # prompt budget for retrieved chunks (estimated at ~4 chars per token)
 
 # UI Settings
 PAGE_TITLE = "Smart Document QA Agent - Enhanced"
@@ -83,9 +87,12 @@ MAX_CONCURRENT_UPLOADS = 3
 PROCESSING_TIMEOUT_SECONDS = 300
 CACHE_ENABLED = True
 CACHE_TTL_SECONDS = 3600
+QUESTION_EMBEDDING_CACHE_SIZE = 2048  # question embeddings kept in memory per QA engine
+ANSWER_CACHE_SIZE = 256  # answers kept for near-duplicate questions
+ANSWER_CACHE_SIMILARITY = 0.95  # minimum question cosine similarity to reuse a cached answer
 
 # Security Settings
-ALLOWED_ORIGINS = ["*"]  # Configure for production
+ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:8501,http://127.0.0.1:8501").split(",")
 CSRF_ENABLED = True
 FILE_VALIDATION_ENABLED = True
 
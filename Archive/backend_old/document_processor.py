@@ -2,20 +2,91 @@
 Document processing module for handling various file types
 """
 import os
-import PyPDF2
-import docx
-from typing import List, Dict, Any, Optional
+import re
+import bisect
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator, Optional
 import logging
 from pathlib import Path
 import hashlib
 
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+    pdfium = None
+
 logger = logging.getLogger(__name__)
 
+HASH_BUFFER_SIZE = 1 << 20  # 1 MiB reads for the pre-3.11 hashing fallback
+PARALLEL_PDF_MIN_PAGES = 4  # pages per worker before extraction fans out
+MAX_POOL_WORKERS = 4
+
+_WS = re.compile(r'\s+')
+_PAGE_MARK = re.compile(r'---\s*Page\s*(\d+)\s*---')
+_SENT_BOUND = re.compile(r'(?<=[.!?])\s+')
+_PARA_BOUND = re.compile(r'\n\s*\n')
+
+def _extract_pdfium_pages(file_path: str, start: int, stop: int) -> List[Optional[str]]:
+    """Extract text for pages [start, stop) with pypdfium2"""
+    page_texts = []
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        for page_num in range(start, stop):
+            try:
+                page = pdf[page_num]
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            except Exception as e:
+                logger.warning(f"Error extracting text from page {page_num + 1}: {str(e)}")
+                page_texts.append(None)
+    finally:
+        pdf.close()
+    return page_texts
+
+def _hash_file(file_path: str) -> str:
+    """BLAKE2b hex digest of a file's contents"""
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: the whole read/update loop runs in C
+            return hashlib.file_digest(f, "blake2b").hexdigest()
+        
+        hasher = hashlib.blake2b()
+        buf = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buf)
+        while True:
+            size = f.readinto(buf)
+            if not size:
+                break
+            hasher.update(view[:size])
+    
+    return hasher.hexdigest()
+
+def _init_tesseract():
+    """Worker initializer: import pytesseract and resolve the tesseract binary once per process"""
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        logger.debug(f"Tesseract not available in worker: {e}")
+
+def _ocr_image(image) -> str:
+    """OCR a single rasterized page in a worker process"""
+    import pytesseract
+    return pytesseract.image_to_string(image) or ""
+
 class DocumentProcessor:
     """
     Handles processing of various document types (PDF, TXT, DOCX)
     """
     
+    # Shared by every instance so worker processes (and their Tesseract setup) persist across calls
+    _worker_pool: Optional[Executor] = None
+    _thread_workers = False
+    
     def __init__(self):
         self.supported_extensions = {'.pdf', '.txt', '.docx', '.doc', '.jpg', '.jpeg', '.png'}
     
@@ -37,9 +108,6 @@ class DocumentProcessor:
         if file_path.suffix.lower() not in self.supported_extensions:
             raise ValueError(f"Unsupported file type: {file_path.suffix}")
         
-        # Generate file hash for unique identification
-        file_hash = self._generate_file_hash(file_path)
-        
         # Extract text based on file type
         if file_path.suffix.lower() == '.pdf':
             text_content = self._extract_pdf_text(file_path)
@@ -54,6 +122,8 @@ class DocumentProcessor:
         
         # Clean and preprocess text
         cleaned_text = self._clean_text(text_content)
+        # Hashed inline: the read is I/O-bound and hashlib releases the GIL on large buffers
+        file_hash = _hash_file(str(file_path))
         
         return {
             'file_path': str(file_path),
@@ -66,38 +136,126 @@ class DocumentProcessor:
             'char_count': len(cleaned_text)
         }
     
+    @classmethod
+    def use_thread_workers(cls):
+        """
+        Run OCR on threads in this process instead of a child process pool.
+        Used as the initializer of processes that are themselves bulk-ingest workers,
+        where cores are already busy and a nested pool would never be shut down.
+        """
+        cls._worker_pool = ThreadPoolExecutor(max_workers=MAX_POOL_WORKERS, initializer=_init_tesseract)
+        cls._thread_workers = True
+    
+    @classmethod
+    def _get_worker_pool(cls) -> Executor:
+        """Create the shared OCR/PDF page process pool on first use"""
+        if cls._worker_pool is None:
+            cls._worker_pool = ProcessPoolExecutor(
+                max_workers=min(MAX_POOL_WORKERS, os.cpu_count() or 1),
+                initializer=_init_tesseract
+            )
+        return cls._worker_pool
+    
+    def process_documents(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        Process several documents concurrently
+        
+        Args:
+            file_paths (List[str]): Paths to the document files
+            
+        Returns:
+            List[Dict[str, Any]]: Document data in the same order as file_paths
+        """
+        # The heavy work runs in the shared process pool, so threads are enough to fan out here
+        with ThreadPoolExecutor(max_workers=min(len(file_paths), MAX_POOL_WORKERS) or 1) as executor:
+            futures = {executor.submit(self.process_document, path): i for i, path in enumerate(file_paths)}
+            results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
+    
     def _extract_pdf_text(self, file_path: Path) -> str:
         """Extract text from PDF file"""
         try:
-            text_content = ""
+            page_texts = self._read_pdf_pages(file_path)
+            
+            # Fallback to OCR for scanned pages, all in one pass
+            empty_pages = [i for i, text in enumerate(page_texts) if text is not None and not text.strip()]
+            if empty_pages:
+                for page_num, ocr_text in self._ocr_pdf_pages(file_path, empty_pages).items():
+                    page_texts[page_num] = ocr_text
+            
+            parts = []
+            for page_num, page_text in enumerate(page_texts):
+                if page_text is None:
+                    continue
+                parts.append(f"\n--- Page {page_num + 1} ---\n")
+                parts.append(page_text)
+                
+            return "".join(parts)
+        except Exception as e:
+            logger.error(f"Error processing PDF {file_path}: {str(e)}")
+            raise
+    
+    def _ocr_pdf_pages(self, file_path: Path, page_indices: List[int]) -> Dict[int, str]:
+        """OCR the given zero-based pages, rasterizing each contiguous run with one pdf2image call"""
+        try:
+            from pdf2image import convert_from_path
+            
+            # Only the requested pages are rendered, and one run's images are held at a time
+            runs = []
+            for page_num in sorted(set(page_indices)):
+                if runs and page_num == runs[-1][1] + 1:
+                    runs[-1][1] = page_num
+                else:
+                    runs.append([page_num, page_num])
+            
+            ocr_texts = {}
+            for first_page, last_page in runs:
+                images = convert_from_path(str(file_path), first_page=first_page + 1, last_page=last_page + 1)
+                texts = self._get_worker_pool().map(_ocr_image, images)
+                ocr_texts.update(zip(range(first_page, last_page + 1), texts))
+                del images
+            return ocr_texts
+        except Exception as ocr_err:
+            logger.warning(f"OCR fallback failed on PDF pages {[i + 1 for i in page_indices]}: {ocr_err}")
+            return {}
+    
+    def _read_pdf_pages(self, file_path: Path) -> List[Optional[str]]:
+        """Extract raw text per page; None marks a page that failed to extract"""
+        if not PDFIUM_AVAILABLE:
+            import PyPDF2
+            page_texts = []
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                
                 for page_num, page in enumerate(pdf_reader.pages):
                     try:
-                        page_text = page.extract_text() or ""
-                        if not page_text.strip():
-                            # Fallback to OCR for scanned pages if available
-                            try:
-                                from pdf2image import convert_from_path
-                                from PIL import Image
-                                import pytesseract
-                                images = convert_from_path(str(file_path), first_page=page_num + 1, last_page=page_num + 1)
-                                if images:
-                                    page_text = pytesseract.image_to_string(images[0]) or ""
-                            except Exception as ocr_err:
-                                logger.warning(f"OCR fallback failed on PDF page {page_num + 1}: {ocr_err}")
-                        text_content += f"\n--- Page {page_num + 1} ---\n"
-                        text_content += page_text
+                        page_texts.append(page.extract_text() or "")
                     except Exception as e:
                         logger.warning(f"Error extracting text from page {page_num + 1}: {str(e)}")
-                        continue
-                
-            return text_content
-        except Exception as e:
-            logger.error(f"Error processing PDF {file_path}: {str(e)}")
-            raise
-
+                        page_texts.append(None)
+            return page_texts
+        
+        pdf = pdfium.PdfDocument(str(file_path))
+        try:
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+        
+        # Inside a bulk-ingest worker the pool is threads, and PDFium is not thread-safe
+        workers = min(MAX_POOL_WORKERS, os.cpu_count() or 1, page_count // PARALLEL_PDF_MIN_PAGES)
+        if workers <= 1 or self._thread_workers:
+            return _extract_pdfium_pages(str(file_path), 0, page_count)
+        
+        # PDFium objects can't cross processes, so each worker opens its own page range
+        bounds = [page_count * i // workers for i in range(workers + 1)]
+        executor = self._get_worker_pool()
+        futures = [
+            executor.submit(_extract_pdfium_pages, str(file_path), bounds[i], bounds[i + 1])
+            for i in range(workers)
+        ]
+        return [text for future in futures for text in future.result()]
+    
     def _extract_image_text(self, file_path: Path) -> str:
         """Extract text from an image using OCR if available"""
         try:
@@ -133,20 +291,16 @@ class DocumentProcessor:
     def _extract_docx_text(self, file_path: Path) -> str:
         """Extract text from DOCX file"""
         try:
+            import docx
             doc = docx.Document(file_path)
-            text_content = ""
-            
-            for paragraph in doc.paragraphs:
-                text_content += paragraph.text + "\n"
+            parts = [paragraph.text + "\n" for paragraph in doc.paragraphs]
             
             # Also extract text from tables
             for table in doc.tables:
                 for row in table.rows:
-                    for cell in row.cells:
-                        text_content += cell.text + " "
-                    text_content += "\n"
+                    parts.append("".join(cell.text + " " for cell in row.cells) + "\n")
             
-            return text_content
+            return "".join(parts)
         except Exception as e:
             logger.error(f"Error processing DOCX file {file_path}: {str(e)}")
             raise
@@ -156,72 +310,45 @@ class DocumentProcessor:
         if not text:
             return ""
         
-        # Normalize whitespace but keep page separators for page mapping
-        lines = text.split('\n')
-        cleaned_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            cleaned_lines.append(line)
-        
-        # Join lines with single newlines
-        cleaned_text = '\n'.join(cleaned_lines)
-        
-        # Remove excessive spaces
-        import re
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-        
-        return cleaned_text.strip()
+        # Collapse every whitespace run (including newlines) to a single space
+        return _WS.sub(' ', text).strip()
     
     def _generate_file_hash(self, file_path: Path) -> str:
-        """Generate SHA-256 hash of file for unique identification"""
-        hash_sha256 = hashlib.sha256()
-        
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        
-        return hash_sha256.hexdigest()
+        """Generate BLAKE2b hash of file for unique identification"""
+        return _hash_file(str(file_path))
     
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict[str, Any]]:
         """
-        Split text into overlapping chunks for better processing
+        Lazily split text into overlapping chunks for better processing
         
         Args:
             text (str): Text to chunk
             chunk_size (int): Size of each chunk
             overlap (int): Overlap between chunks
             
-        Returns:
-            List[Dict[str, Any]]: List of text chunks with metadata
+        Yields:
+            Dict[str, Any]: Text chunks with metadata
         """
         if not text:
-            return []
+            return
         
-        chunks = []
 
         # Build page marker index to map positions to page numbers
         page_markers: List[Tuple[int, int]] = []  # (position_index, page_number)
-        import re as _re
-        for match in _re.finditer(r"---\s*Page\s*(\d+)\s*---", text):
+        for match in _PAGE_MARK.finditer(text):
             try:
                 page_num = int(match.group(1))
                 page_markers.append((match.start(), page_num))
             except Exception:
                 continue
 
+        # Markers are found in text order, so positions are already sorted
+        marker_positions = [marker_pos for marker_pos, _ in page_markers]
+        marker_pages = [pnum for _, pnum in page_markers]
+
         def find_page_for_pos(pos: int) -> Optional[int]:
-            if not page_markers:
-                return None
-            current = None
-            for marker_pos, pnum in page_markers:
-                if marker_pos <= pos:
-                    current = pnum
-                else:
-                    break
-            return current
+            i = bisect.bisect_right(marker_positions, pos) - 1
+            return marker_pages[i] if i >= 0 else None
         start = 0
         chunk_id = 0
         
@@ -230,31 +357,35 @@ class DocumentProcessor:
             
             # Try to break at sentence boundary
             if end < len(text):
-                # Look for sentence endings near the chunk boundary
-                for i in range(end, max(start + chunk_size - 100, start), -1):
-                    if text[i] in '.!?':
-                        end = i + 1
-                        break
+                # Look for sentence endings in the last 100 characters, up to and including end
+                low = max(start + chunk_size - 100, start) + 1
+                boundary = max(text.rfind('.', low, end + 1), text.rfind('!', low, end + 1), text.rfind('?', low, end + 1))
+                if boundary >= 0:
+                    end = boundary + 1
             
-            chunk_text = text[start:end].strip()
+            # Trim by index so each chunk is sliced once instead of slice + strip
+            lo, hi = start, min(end, len(text))
+            while lo < hi and text[lo].isspace():
+                lo += 1
+            while hi > lo and text[hi - 1].isspace():
+                hi -= 1
             
-            if chunk_text:  # Only add non-empty chunks
-                chunks.append({
+            if lo < hi:  # Only yield non-empty chunks
+                chunk_text = text[lo:hi]
+                yield {
                     'chunk_id': chunk_id,
                     'text': chunk_text,
                     'start_pos': start,
                     'end_pos': end,
                     'length': len(chunk_text),
                     'page_number': find_page_for_pos(start)
-                })
+                }
                 chunk_id += 1
             
             # Move start position with overlap
             start = end - overlap
             if start <= 0:
                 start = end
-        
-        return chunks
     
     def get_document_summary(self, document_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -268,13 +399,14 @@ class DocumentProcessor:
         """
         content = document_data['content']
         
-        # Basic statistics
-        words = content.split()
-        sentences = content.split('.')
-        paragraphs = content.split('\n\n')
+        # Only the first three sentence boundaries are needed for the preview
+        sentences = _SENT_BOUND.split(content, maxsplit=3)
+        preview = ' '.join(sentences[:3]) if len(sentences) > 3 else content[:200] + "..."
         
-        # Get first few sentences as preview
-        preview = '. '.join(sentences[:3]) + '.' if len(sentences) > 3 else content[:200] + "..."
+        # Count boundaries instead of materializing every sentence and paragraph
+        has_text = bool(content.strip())
+        sentence_count = len(_SENT_BOUND.findall(content)) + 1 if has_text else 0
+        paragraph_count = len(_PARA_BOUND.findall(content.strip())) + 1 if has_text else 0
         
         return {
             'file_name': document_data['file_name'],
@@ -282,8 +414,8 @@ class DocumentProcessor:
             'file_size_mb': round(document_data['file_size'] / (1024 * 1024), 2),
             'word_count': document_data['word_count'],
             'char_count': document_data['char_count'],
-            'sentence_count': len([s for s in sentences if s.strip()]),
-            'paragraph_count': len([p for p in paragraphs if p.strip()]),
+            'sentence_count': sentence_count,
+            'paragraph_count': paragraph_count,
             'preview': preview,
             'processed_at': document_data.get('processed_at', 'Unknown')
         }
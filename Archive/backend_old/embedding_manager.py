@@ -3,15 +3,50 @@ Embedding management system for document vectorization
 """
 import os
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
-from sentence_transformers import SentenceTransformer
+from functools import cached_property
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from config import EMBEDDING_BACKEND, EMBEDDING_ONNX_FILE
 import logging
 import pickle
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
 import hashlib
 
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    faiss = None
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+    xxhash = None
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
+CACHE_MATRIX_FILE = "embeddings.npy"
+CACHE_INDEX_FILE = "embeddings_index.sqlite"
+INITIAL_CACHE_ROWS = 1024
+ENCODE_BATCH_SIZE = 64
+MIN_CACHED_TEXT_LENGTH = 32  # shorter texts encode faster than a cache round trip
+SQLITE_MAX_PARAMS = 900  # stay under SQLite's default bound-parameter limit
+ANN_MIN_CANDIDATES = 10000  # below this an exact matmul beats building an HNSW graph
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+MICRO_BATCH_SIZE = 32  # most queued texts encoded in one call
+MICRO_BATCH_WAIT_MS = 10  # how long the first queued text waits for company
+
 class EmbeddingManager:
     """
     Manages text embeddings using sentence transformers
@@ -28,15 +63,38 @@ class EmbeddingManager:
         self.model_name = model_name
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
+        self._open_cache()
         
-        # Initialize the sentence transformer model
+        # Normalized candidate matrix (and its ANN index) reused across similarity calls
+        self._candidates_source = None
+        self._candidates_normed = None
+        self._ann_index = None
+    
+    @cached_property
+    def model(self) -> "SentenceTransformer":
+        """Sentence transformer model, loaded on first use so imports stay cheap"""
         try:
-            self.model = SentenceTransformer(model_name)
-            logger.info(f"Loaded embedding model: {model_name}")
+            model = self._load_model(self.model_name)
+            logger.info(f"Loaded embedding model: {self.model_name}")
+            return model
         except Exception as e:
-            logger.error(f"Failed to load embedding model {model_name}: {str(e)}")
+            logger.error(f"Failed to load embedding model {self.model_name}: {str(e)}")
             raise
     
+    def _load_model(self, model_name: str) -> "SentenceTransformer":
+        """Load the model on ONNX Runtime when configured, falling back to PyTorch"""
+        # Pulls in torch/transformers, so only imported once a model is actually needed
+        from sentence_transformers import SentenceTransformer
+        
+        if EMBEDDING_BACKEND == "onnx":
+            try:
+                model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+                return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+            except Exception as e:
+                logger.warning(f"ONNX Runtime backend unavailable for {model_name}, using PyTorch: {str(e)}")
+        
+        return SentenceTransformer(model_name)
+    
     def generate_embeddings(self, texts: List[str], use_cache: bool = True) -> np.ndarray:
         """
         Generate embeddings for a list of texts
@@ -51,16 +109,15 @@ class EmbeddingManager:
         if not texts:
             return np.array([])
         
-        embeddings = []
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        cached = self._get_cached_embeddings(texts) if use_cache else {}
         uncached_texts = []
         uncached_indices = []
         
         for i, text in enumerate(texts):
-            if use_cache:
-                cached_embedding = self._get_cached_embedding(text)
-                if cached_embedding is not None:
-                    embeddings.append(cached_embedding)
-                    continue
+            if i in cached:
+                embeddings[i] = cached[i]
+                continue
             
             uncached_texts.append(text)
             uncached_indices.append(i)
@@ -68,22 +125,29 @@ class EmbeddingManager:
         # Generate embeddings for uncached texts
         if uncached_texts:
             try:
-                new_embeddings = self.model.encode(uncached_texts, show_progress_bar=False)
+                new_embeddings = self.model.encode(
+                    uncached_texts,
+                    batch_size=ENCODE_BATCH_SIZE,
+                    show_progress_bar=False,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
                 
-                # Cache new embeddings
+                # Cache new embeddings; short texts are cheaper to re-encode than to look up
                 if use_cache:
-                    for text, embedding in zip(uncached_texts, new_embeddings):
-                        self._cache_embedding(text, embedding)
+                    cacheable = [j for j, text in enumerate(uncached_texts) if len(text) >= MIN_CACHED_TEXT_LENGTH]
+                    if cacheable:
+                        self._cache_embeddings([uncached_texts[j] for j in cacheable], new_embeddings[cacheable])
                 
-                # Insert new embeddings at correct positions
+                # Fill the slots left open by cache misses
                 for i, embedding in zip(uncached_indices, new_embeddings):
-                    embeddings.insert(i, embedding)
+                    embeddings[i] = embedding
                     
             except Exception as e:
                 logger.error(f"Error generating embeddings: {str(e)}")
                 raise
         
-        return np.array(embeddings)
+        return np.stack(embeddings)
     
     def generate_single_embedding(self, text: str, use_cache: bool = True) -> np.ndarray:
         """
@@ -99,34 +163,127 @@ class EmbeddingManager:
         embeddings = self.generate_embeddings([text], use_cache)
         return embeddings[0] if len(embeddings) > 0 else np.array([])
     
-    def _get_cached_embedding(self, text: str) -> Optional[np.ndarray]:
-        """Get cached embedding for text if it exists"""
+    def _open_cache(self):
+        """Open the memory-mapped embedding matrix and its hash -> row index"""
+        self._cache_matrix_path = self.cache_dir / CACHE_MATRIX_FILE
+        self._cache_index = sqlite3.connect(str(self.cache_dir / CACHE_INDEX_FILE), check_same_thread=False)
+        self._cache_matrix = None
+        # Callers and the BatchingEmbedder worker share the connection and the memmap
+        self._cache_lock = threading.Lock()
+        
+        if self._cache_matrix_path.exists():
+            self._cache_matrix = np.load(self._cache_matrix_path, mmap_mode="r+")
+            if self._cache_matrix.dtype != np.int8:
+                logger.warning("Embedding cache is not int8-quantized, rebuilding it")
+                self._cache_matrix = None
+                self._cache_matrix_path.unlink()
+                self._cache_index.execute("DROP TABLE IF EXISTS idx")
+        
+        self._cache_index.execute(
+            "CREATE TABLE IF NOT EXISTS idx (hash TEXT PRIMARY KEY, row INTEGER NOT NULL, scale REAL NOT NULL)"
+        )
+        self._cache_rows = self._cache_index.execute("SELECT COUNT(*) FROM idx").fetchone()[0]
+        
+        if self._cache_matrix is None and self._cache_rows:
+            logger.warning("Embedding cache matrix is missing, resetting cache index")
+            self._cache_index.execute("DELETE FROM idx")
+            self._cache_index.commit()
+            self._cache_rows = 0
+    
+    def _get_cached_embeddings(self, texts: List[str]) -> Dict[int, np.ndarray]:
+        """Look up cached embeddings for many texts at once, keyed by position in texts"""
+        positions: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if len(text) >= MIN_CACHED_TEXT_LENGTH:
+                positions.setdefault(self._hash_text(text), []).append(i)
+        
+        found = {}
+        if not positions:
+            return found
+        
         try:
-            text_hash = self._hash_text(text)
-            cache_file = self.cache_dir / f"{text_hash}.pkl"
-            
-            if cache_file.exists():
-                with open(cache_file, 'rb') as f:
-                    return pickle.load(f)
+            hashes = list(positions)
+            with self._cache_lock:
+                if self._cache_matrix is None:
+                    return found
+                for offset in range(0, len(hashes), SQLITE_MAX_PARAMS):
+                    batch = hashes[offset:offset + SQLITE_MAX_PARAMS]
+                    rows = self._cache_index.execute(
+                        f"SELECT hash, row, scale FROM idx WHERE hash IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                    for text_hash, row, scale in rows:
+                        embedding = self._cache_matrix[row].astype(np.float32) * np.float32(scale)
+                        for i in positions[text_hash]:
+                            found[i] = embedding
         except Exception as e:
-            logger.warning(f"Error loading cached embedding: {str(e)}")
+            logger.warning(f"Error loading cached embeddings: {str(e)}")
         
-        return None
+        return found
     
     def _cache_embedding(self, text: str, embedding: np.ndarray):
         """Cache embedding for text"""
-        try:
-            text_hash = self._hash_text(text)
-            cache_file = self.cache_dir / f"{text_hash}.pkl"
-            
-            with open(cache_file, 'wb') as f:
-                pickle.dump(embedding, f)
-        except Exception as e:
-            logger.warning(f"Error caching embedding: {str(e)}")
+        self._cache_embeddings([text], [embedding])
+    
+    def _cache_embeddings(self, texts: List[str], embeddings: np.ndarray):
+        """Quantize embeddings to int8, append them to the cache matrix and index them in one transaction"""
+        with self._cache_lock:
+            try:
+                with self._cache_index:
+                    for text, embedding in zip(texts, embeddings):
+                        text_hash = self._hash_text(text)
+                        if self._cache_index.execute("SELECT 1 FROM idx WHERE hash = ?", (text_hash,)).fetchone():
+                            continue
+                        
+                        # Symmetric per-vector scale maps the largest component to +/-127
+                        max_abs = float(np.abs(embedding).max()) if len(embedding) else 0.0
+                        scale = max_abs / 127 if max_abs > 0 else 1.0
+                        
+                        # The row comes from the index itself, so it is never handed out twice
+                        row = self._cache_index.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM idx").fetchone()[0]
+                        self._reserve_cache_row(row, len(embedding))
+                        self._cache_matrix[row] = np.round(np.asarray(embedding) / scale).astype(np.int8)
+                        self._cache_index.execute(
+                            "INSERT INTO idx (hash, row, scale) VALUES (?, ?, ?)", (text_hash, row, scale)
+                        )
+                    
+                    if self._cache_matrix is not None:
+                        self._cache_matrix.flush()
+            except Exception as e:
+                # The index rolled back, so rows written past its end are free again
+                logger.warning(f"Error caching embedding: {str(e)}")
+            self._cache_rows = self._cache_index.execute("SELECT COUNT(*) FROM idx").fetchone()[0]
+    
+    def _reserve_cache_row(self, row: int, dimension: int):
+        """Make room for the given row, doubling the on-disk matrix when full; caller holds _cache_lock"""
+        if self._cache_matrix is None:
+            self._cache_matrix = np.lib.format.open_memmap(
+                self._cache_matrix_path, mode="w+", dtype=np.int8, shape=(INITIAL_CACHE_ROWS, dimension)
+            )
+            return
+        
+        if self._cache_matrix.shape[1] != dimension:
+            raise ValueError(f"Embedding dimension {dimension} does not match cache dimension {self._cache_matrix.shape[1]}")
+        
+        if row < self._cache_matrix.shape[0]:
+            return
+        
+        grown_path = self._cache_matrix_path.with_suffix(".grow.npy")
+        grown = np.lib.format.open_memmap(
+            grown_path, mode="w+", dtype=np.int8, shape=(2 * self._cache_matrix.shape[0], dimension)
+        )
+        grown[:row] = self._cache_matrix[:row]
+        grown.flush()
+        del grown
+        self._cache_matrix = None
+        os.replace(grown_path, self._cache_matrix_path)
+        self._cache_matrix = np.load(self._cache_matrix_path, mmap_mode="r+")
     
     def _hash_text(self, text: str) -> str:
-        """Generate hash for text"""
-        return hashlib.md5(text.encode('utf-8')).hexdigest()
+        """Generate a non-cryptographic cache key for text"""
+        data = text.encode('utf-8')
+        if XXHASH_AVAILABLE:
+            return xxhash.xxh3_64_hexdigest(data)
+        return hashlib.blake2b(data, digest_size=8).hexdigest()
     
     def compute_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
@@ -166,16 +323,66 @@ class EmbeddingManager:
         if len(candidate_embeddings) == 0:
             return []
         
-        # Compute similarities
-        similarities = []
-        for i, candidate in enumerate(candidate_embeddings):
-            similarity = self.compute_similarity(query_embedding, candidate)
-            similarities.append((i, similarity))
+        query_norm = np.linalg.norm(query_embedding)
+        if query_norm == 0:
+            return [(i, 0.0) for i in range(min(top_k, len(candidate_embeddings)))]
+        
+        normalized_query = query_embedding / query_norm
+        index = self._candidates_ann_index(candidate_embeddings)
+        if index is not None:
+            return self._ann_search(index, normalized_query[np.newaxis, :], top_k)[0]
         
-        # Sort by similarity (descending)
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        # One matrix-vector product scores every candidate
+        similarities = self._normalized_candidates(candidate_embeddings) @ normalized_query
+        return self._top_k(similarities, top_k)
+    
+    def _normalized_candidates(self, candidate_embeddings: np.ndarray) -> np.ndarray:
+        """Return L2-normalized candidates, reusing the result for the same array"""
+        if (self._candidates_source is not candidate_embeddings
+                or self._candidates_normed.shape != np.shape(candidate_embeddings)):
+            matrix = np.asarray(candidate_embeddings, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._candidates_normed = matrix / norms
+            self._candidates_source = candidate_embeddings
+            self._ann_index = None
+        return self._candidates_normed
+    
+    def _candidates_ann_index(self, candidate_embeddings: np.ndarray):
+        """Return an HNSW index over the normalized candidates, or None for small or FAISS-less setups"""
+        if not FAISS_AVAILABLE or len(candidate_embeddings) < ANN_MIN_CANDIDATES:
+            return None
         
-        return similarities[:top_k]
+        normalized = self._normalized_candidates(candidate_embeddings)
+        if self._ann_index is None:
+            # Inner product over unit vectors is cosine similarity
+            index = faiss.IndexHNSWFlat(normalized.shape[1], HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+            index.add(np.ascontiguousarray(normalized))
+            self._ann_index = index
+        return self._ann_index
+    
+    @staticmethod
+    def _ann_search(index, normalized_queries: np.ndarray, top_k: int) -> List[List[Tuple[int, float]]]:
+        """Search the ANN index, dropping the -1 padding FAISS uses for missing neighbours"""
+        scores, indices = index.search(np.ascontiguousarray(normalized_queries, dtype=np.float32), top_k)
+        return [
+            [(int(i), float(score)) for i, score in zip(row_indices, row_scores) if i >= 0]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+    
+    @staticmethod
+    def _top_k(similarities: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Select the top_k scores without sorting the full array"""
+        top_k = min(top_k, len(similarities))
+        if top_k <= 0:
+            return []
+        if top_k < len(similarities):
+            indices = np.argpartition(-similarities, top_k - 1)[:top_k]
+        else:
+            indices = np.arange(len(similarities))
+        indices = indices[np.argsort(-similarities[indices], kind='stable')]
+        return [(int(i), float(similarities[i])) for i in indices]
     
     def batch_similarity_search(self, query_embeddings: np.ndarray, candidate_embeddings: np.ndarray,
                                top_k: int = 5) -> List[List[Tuple[int, float]]]:
@@ -190,13 +397,41 @@ class EmbeddingManager:
         Returns:
             List[List[Tuple[int, float]]]: List of results for each query
         """
-        results = []
+        if len(query_embeddings) == 0:
+            return []
+        if len(candidate_embeddings) == 0:
+            return [[] for _ in range(len(query_embeddings))]
+        
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        query_norms[query_norms == 0] = 1.0
+        
+        normalized_queries = queries / query_norms
+        index = self._candidates_ann_index(candidate_embeddings)
+        if index is not None:
+            return self._ann_search(index, normalized_queries, top_k)
+        
+        # One (Q, D) @ (D, N) product scores every query against every candidate
+        similarities = normalized_queries @ self._normalized_candidates(candidate_embeddings).T
         
-        for query_embedding in query_embeddings:
-            query_results = self.find_most_similar(query_embedding, candidate_embeddings, top_k)
-            results.append(query_results)
+        top_k = min(top_k, similarities.shape[1])
+        if top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        if top_k < similarities.shape[1]:
+            indices = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+        else:
+            indices = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+        scores = np.take_along_axis(similarities, indices, axis=1)
         
-        return results
+        # Only the top_k columns of each row get sorted
+        order = np.argsort(-scores, axis=1, kind='stable')
+        indices = np.take_along_axis(indices, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        
+        return [
+            [(int(i), float(score)) for i, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
     
     def get_model_info(self) -> Dict[str, Any]:
         """
@@ -210,16 +445,20 @@ class EmbeddingManager:
             'max_seq_length': getattr(self.model, 'max_seq_length', 'Unknown'),
             'embedding_dimension': self.model.get_sentence_embedding_dimension(),
             'cache_dir': str(self.cache_dir),
-            'cache_size': len(list(self.cache_dir.glob('*.pkl'))) if self.cache_dir.exists() else 0
+            'cache_size': self._cache_rows
         }
     
     def clear_cache(self):
         """Clear the embedding cache"""
         try:
-            cache_files = list(self.cache_dir.glob('*.pkl'))
-            for cache_file in cache_files:
-                cache_file.unlink()
-            logger.info(f"Cleared {len(cache_files)} cached embeddings")
+            with self._cache_lock:
+                cleared = self._cache_rows
+                with self._cache_index:
+                    self._cache_index.execute("DELETE FROM idx")
+                self._cache_rows = 0
+                self._cache_matrix = None
+                self._cache_matrix_path.unlink(missing_ok=True)
+            logger.info(f"Cleared {cleared} cached embeddings")
         except Exception as e:
             logger.error(f"Error clearing cache: {str(e)}")
     
@@ -270,3 +509,73 @@ class EmbeddingManager:
             logger.error(f"Error loading embeddings: {str(e)}")
             raise
 
+
+class BatchingEmbedder:
+    """
+    Coalesces concurrent single-text embedding requests into batched model calls
+    """
+    
+    def __init__(self, embedding_manager: EmbeddingManager, max_batch: int = MICRO_BATCH_SIZE,
+                 max_wait_ms: float = MICRO_BATCH_WAIT_MS):
+        """
+        Initialize the batching embedder
+        
+        Args:
+            embedding_manager (EmbeddingManager): Manager used to encode each batch
+            max_batch (int): Maximum number of texts per model call
+            max_wait_ms (float): Maximum time a request waits for others to join its batch
+        """
+        self.embedding_manager = embedding_manager
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+    
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed one text, sharing a model call with other texts queued at the same time
+        
+        Args:
+            text (str): Text to embed
+            
+        Returns:
+            np.ndarray: Text embedding
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+    
+    def _ensure_worker(self):
+        """Start the background batching thread on first use"""
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+    
+    def _run(self):
+        """Drain the queue into batches of up to max_batch texts or max_wait seconds"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.embedding_manager.generate_embeddings(texts)
+            except Exception as e:
+                logger.error(f"Error generating batched embeddings: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
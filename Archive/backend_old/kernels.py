@@ -0,0 +1,45 @@
+"""
+Compiled similarity kernels for the brute-force vector search path
+"""
+import numpy as np
+from numba import njit, prange
+
+# Fast-math without 'nnan'/'ninf': the top-k buffer is seeded with -inf and compared against it
+FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+@njit(parallel=True, fastmath=FASTMATH_FLAGS, cache=True)
+def top_k_cosine(embeddings, query, k):
+    """
+    Top-k dot products of unit-norm rows against a unit-norm query
+
+    Args:
+        embeddings (np.ndarray): float32 matrix of shape (n, d)
+        query (np.ndarray): float32 vector of shape (d,)
+        k (int): Number of results, at most n
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Row indices and scores, best first
+    """
+    n, d = embeddings.shape
+    sims = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        s = np.float32(0.0)
+        for j in range(d):
+            s += embeddings[i, j] * query[j]
+        sims[i] = s
+
+    # Keep the best k in a small sorted buffer; most rows fail the first comparison
+    top_idx = np.empty(k, dtype=np.int64)
+    top_sims = np.full(k, -np.inf, dtype=np.float32)
+    for i in range(n):
+        s = sims[i]
+        if s <= top_sims[k - 1]:
+            continue
+        pos = k - 1
+        while pos > 0 and top_sims[pos - 1] < s:
+            top_sims[pos] = top_sims[pos - 1]
+            top_idx[pos] = top_idx[pos - 1]
+            pos -= 1
+        top_sims[pos] = s
+        top_idx[pos] = i
+    return top_idx, top_sims
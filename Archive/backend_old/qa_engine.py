@@ -2,20 +2,33 @@
 Question Answering Engine with semantic search capabilities
 """
 import os
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import json
+from functools import lru_cache
+import numpy as np
 
 # Import Google AI
 import google.generativeai as genai
 from document_processor import DocumentProcessor
-from embedding_manager import EmbeddingManager
-from vector_database import VectorDatabase
-from config import TOP_K_RESULTS, GOOGLE_AI_API_KEY, MODEL_NAME
+from embedding_manager import EmbeddingManager, BatchingEmbedder
+from vector_database import VectorDatabase, write_json
+from config import (TOP_K_RESULTS, GOOGLE_AI_API_KEY, MODEL_NAME, QUESTION_EMBEDDING_CACHE_SIZE,
+                    ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY, MAX_CONTEXT_TOKENS)
 
 logger = logging.getLogger(__name__)
 
+CHARS_PER_TOKEN = 4  # rough average for English text
+
+def _parse_and_chunk(file_path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Extract and chunk one document; runs in a worker process during bulk ingest"""
+    document_processor = DocumentProcessor()
+    document_data = document_processor.process_document(file_path)
+    chunks = list(document_processor.chunk_text(document_data['content']))
+    return document_data, chunks
+
 class QAEngine:
     """
     Main QA Engine that combines document processing, embeddings, and AI generation
@@ -31,6 +44,7 @@ class QAEngine:
         # Initialize components
         self.document_processor = DocumentProcessor()
         self.embedding_manager = EmbeddingManager()
+        self.embedding_batcher = BatchingEmbedder(self.embedding_manager)
         self.vector_db = VectorDatabase()
         
         # Initialize Google AI
@@ -45,6 +59,104 @@ class QAEngine:
         
         # Conversation history
         self.conversation_history = []
+        
+        # Per-instance LRU of question embeddings, keyed by normalized question text
+        self._cached_question_embedding = lru_cache(maxsize=QUESTION_EMBEDDING_CACHE_SIZE)(
+            self._generate_question_embedding
+        )
+        
+        # Semantic answer cache: a ring of ANSWER_CACHE_SIZE unit-norm question embeddings
+        # (allocated on first insert) and their answers; empty slots hold zero rows and None
+        self._answer_cache_lock = threading.Lock()
+        self._answer_cache_vecs = None
+        self._answer_cache_entries = [None] * ANSWER_CACHE_SIZE
+        self._answer_cache_cursor = 0
+        # Bumped by every invalidation so answers built from older documents are not stored
+        self._answer_cache_generation = 0
+    
+    def _generate_question_embedding(self, normalized_question: str) -> np.ndarray:
+        """Embed a normalized question; the result is shared by cache hits, so it is made read-only"""
+        embedding = self.embedding_batcher.embed(normalized_question)
+        embedding.flags.writeable = False
+        return embedding
+    
+    def _lookup_cached_answer(self, question_embedding: np.ndarray,
+                              scope: Optional[Tuple[str, ...]]) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer for a near-duplicate question asked over the same documents
+        
+        Args:
+            question_embedding (np.ndarray): Embedding of the new question
+            scope (Tuple[str, ...], optional): Sorted document IDs the question is restricted to
+            
+        Returns:
+            Optional[Dict[str, Any]]: Cached entry, or None on a miss
+        """
+        query = question_embedding / (np.linalg.norm(question_embedding) + 1e-12)
+        with self._answer_cache_lock:
+            if self._answer_cache_vecs is None:
+                return None
+            similarities = self._answer_cache_vecs @ query
+            for idx in np.argsort(-similarities):
+                if similarities[idx] < ANSWER_CACHE_SIMILARITY:
+                    break
+                entry = self._answer_cache_entries[idx]
+                if entry is not None and entry['scope'] == scope:
+                    return entry
+        return None
+    
+    def _cache_answer(self, question_embedding: np.ndarray, scope: Optional[Tuple[str, ...]],
+                      answer: str, sources: List[Dict[str, Any]], document_ids: set, generation: int):
+        """
+        Remember an answer, overwriting the oldest slot once the ring is full
+        
+        Args:
+            generation (int): _answer_cache_generation read before retrieval; the answer
+                is dropped if documents were added or removed since
+        """
+        vec = question_embedding / (np.linalg.norm(question_embedding) + 1e-12)
+        entry = {'scope': scope, 'answer': answer, 'sources': sources, 'document_ids': document_ids}
+        
+        with self._answer_cache_lock:
+            if generation != self._answer_cache_generation:
+                return
+            if self._answer_cache_vecs is None:
+                self._answer_cache_vecs = np.zeros((ANSWER_CACHE_SIZE, vec.shape[0]), dtype=np.float32)
+            cursor = self._answer_cache_cursor
+            self._answer_cache_vecs[cursor] = vec
+            self._answer_cache_entries[cursor] = entry
+            self._answer_cache_cursor = (cursor + 1) % ANSWER_CACHE_SIZE
+    
+    def _invalidate_cached_answers(self, document_id: Optional[str] = None):
+        """
+        Drop cached answers built from a document, or all of them when no ID is given
+        
+        Args:
+            document_id (str, optional): Removed document ID
+        """
+        with self._answer_cache_lock:
+            self._answer_cache_generation += 1
+            if self._answer_cache_vecs is None:
+                return
+            for i, entry in enumerate(self._answer_cache_entries):
+                if entry is not None and (document_id is None or document_id in entry['document_ids']):
+                    self._answer_cache_entries[i] = None
+                    self._answer_cache_vecs[i] = 0.0
+            if document_id is None:
+                self._answer_cache_cursor = 0
+    
+    def _question_embedding(self, question: str) -> np.ndarray:
+        """
+        Get the embedding for a question, reusing it for repeated questions
+        
+        Args:
+            question (str): Question or search query
+            
+        Returns:
+            np.ndarray: Question embedding
+        """
+        normalized = " ".join(question.lower().split())
+        return self._cached_question_embedding(normalized)
     
     def add_document(self, file_path: str) -> Dict[str, Any]:
         """
@@ -62,7 +174,7 @@ class QAEngine:
             document_data = self.document_processor.process_document(file_path)
             
             # Chunk the document
-            chunks = self.document_processor.chunk_text(document_data['content'])
+            chunks = list(self.document_processor.chunk_text(document_data['content']))
             
             if not chunks:
                 raise ValueError("No text chunks could be extracted from the document")
@@ -74,6 +186,9 @@ class QAEngine:
             # Add to vector database
             document_id = self.vector_db.add_document(document_data, chunks, embeddings)
             
+            # Cached answers did not see the new document
+            self._invalidate_cached_answers()
+            
             # Generate summary
             summary = self.document_processor.get_document_summary(document_data)
             
@@ -98,6 +213,95 @@ class QAEngine:
                 'message': f"Failed to add document: {str(e)}"
             }
     
+    def add_documents(self, file_paths: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Add several documents, parsing them in parallel and embedding all chunks in one pass
+        
+        Args:
+            file_paths (List[str]): Paths to the document files
+            workers (int, optional): Parser processes; defaults to one less than the CPU count
+            
+        Returns:
+            List[Dict[str, Any]]: Processing results in the same order as file_paths
+        """
+        if workers is None:
+            workers = max((os.cpu_count() or 1) - 1, 1)
+        workers = min(workers, len(file_paths))
+        
+        # Parse and chunk each file, in worker processes when more than one is allowed
+        parsed = []
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=DocumentProcessor.use_thread_workers) as pool:
+                futures = [pool.submit(_parse_and_chunk, file_path) for file_path in file_paths]
+                for future in futures:
+                    try:
+                        parsed.append(future.result())
+                    except Exception as e:
+                        parsed.append(e)
+        else:
+            for file_path in file_paths:
+                try:
+                    parsed.append(_parse_and_chunk(file_path))
+                except Exception as e:
+                    parsed.append(e)
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        ready = []
+        for i, (file_path, item) in enumerate(zip(file_paths, parsed)):
+            if not isinstance(item, Exception) and not item[1]:
+                item = ValueError("No text chunks could be extracted from the document")
+            if isinstance(item, Exception):
+                logger.error(f"Error adding document {file_path}: {str(item)}")
+                results[i] = {
+                    'success': False,
+                    'error': str(item),
+                    'message': f"Failed to add document: {str(item)}"
+                }
+            else:
+                ready.append((i, *item))
+        
+        if ready:
+            # One embedding pass over every chunk amortizes model overhead across files
+            all_texts = [chunk['text'] for _, _, chunks in ready for chunk in chunks]
+            try:
+                embeddings = self.embedding_manager.generate_embeddings(all_texts)
+            except Exception as e:
+                # Fall back to one pass per file so a bad file only fails itself
+                logger.warning(f"Batched embedding failed, embedding files one at a time: {str(e)}")
+                embeddings = None
+            
+            offset = 0
+            for i, document_data, chunks in ready:
+                try:
+                    if embeddings is None:
+                        doc_embeddings = self.embedding_manager.generate_embeddings([chunk['text'] for chunk in chunks])
+                    else:
+                        doc_embeddings = embeddings[offset:offset + len(chunks)]
+                        offset += len(chunks)
+                    document_id = self.vector_db.add_document(document_data, chunks, doc_embeddings)
+                    results[i] = {
+                        'success': True,
+                        'document_id': document_id,
+                        'file_name': document_data['file_name'],
+                        'chunk_count': len(chunks),
+                        'word_count': document_data['word_count'],
+                        'summary': self.document_processor.get_document_summary(document_data),
+                        'message': f"Document '{document_data['file_name']}' added successfully"
+                    }
+                    logger.info(f"Document added successfully: {document_data['file_name']}")
+                except Exception as e:
+                    logger.error(f"Error adding document {file_paths[i]}: {str(e)}")
+                    results[i] = {
+                        'success': False,
+                        'error': str(e),
+                        'message': f"Failed to add document: {str(e)}"
+                    }
+            
+            # Cached answers did not see the new documents
+            self._invalidate_cached_answers()
+        
+        return results
+    
     def remove_document(self, document_id: str) -> Dict[str, Any]:
         """
         Remove a document from the knowledge base
@@ -112,6 +316,7 @@ class QAEngine:
             success = self.vector_db.remove_document(document_id)
             
             if success:
+                self._invalidate_cached_answers(document_id)
                 return {
                     'success': True,
                     'message': f"Document {document_id} removed successfully"
@@ -179,7 +384,34 @@ class QAEngine:
         """
         try:
             # Generate embedding for the question
-            question_embedding = self.embedding_manager.generate_single_embedding(question)
+            question_embedding = self._question_embedding(question)
+            
+            # Build conversation history if enabled
+            conversation_context = ""
+            if use_conversation_history and self.conversation_history:
+                recent_history = self.conversation_history[-3:]  # Last 3 exchanges
+                conversation_context = self._format_conversation_history(recent_history)
+            
+            # Reuse the answer to a near-duplicate question and skip generation; answers
+            # that depend on the conversation so far are neither reused nor cached
+            scope = tuple(sorted(context_documents)) if context_documents else None
+            cache_generation = self._answer_cache_generation
+            cached = None if conversation_context else self._lookup_cached_answer(question_embedding, scope)
+            if cached is not None:
+                self.conversation_history.append({
+                    'question': question,
+                    'answer': cached['answer'],
+                    'timestamp': datetime.now().isoformat(),
+                    'sources': [source['document_name'] for source in cached['sources']]
+                })
+                return {
+                    'success': True,
+                    'question': question,
+                    'answer': cached['answer'],
+                    'sources': cached['sources'],
+                    'cached': True,
+                    'timestamp': datetime.now().isoformat()
+                }
             
             # Search for relevant chunks
             search_results = []
@@ -191,16 +423,24 @@ class QAEngine:
                 )
                 search_results.extend(results)
             
-            # Sort by similarity and take top results
+            # Sort by similarity and take top results, skipping repeated chunk text (headers, footers)
             search_results.sort(key=lambda x: x['similarity'], reverse=True)
-            top_results = search_results[:TOP_K_RESULTS]
+            top_results = []
+            seen_texts = set()
+            for result in search_results:
+                if result['chunk_text'] in seen_texts:
+                    continue
+                seen_texts.add(result['chunk_text'])
+                top_results.append(result)
+                if len(top_results) == TOP_K_RESULTS:
+                    break
             
             if not top_results:
                 # Generate AI fallback with explicit warning
                 fallback_answer = self._generate_answer(
                     question,
                     context="",
-                    conversation_context=self._format_conversation_history(self.conversation_history[-3:]) if use_conversation_history else ""
+                    conversation_context=conversation_context
                 ) if self.genai_client else ""
                 return {
                     'success': True,
@@ -210,40 +450,31 @@ class QAEngine:
                     'timestamp': datetime.now().isoformat()
                 }
             
-            # Prepare context for the AI model
-            context_text = self._prepare_context(top_results)
-            
-            # Build conversation history if enabled
-            conversation_context = ""
-            if use_conversation_history and self.conversation_history:
-                recent_history = self.conversation_history[-3:]  # Last 3 exchanges
-                conversation_context = self._format_conversation_history(recent_history)
+            # Prepare context for the AI model and the source list in one pass
+            context_text, sources = self._prepare_context(top_results)
             
             # Generate answer using Google AI
             answer = self._generate_answer(question, context_text, conversation_context)
             
             # Store in conversation history
+            now_iso = datetime.now().isoformat()
             self.conversation_history.append({
                 'question': question,
                 'answer': answer,
-                'timestamp': datetime.now().isoformat(),
-                'sources': [result['document_name'] for result in top_results]
+                'timestamp': now_iso,
+                'sources': [source['document_name'] for source in sources]
             })
             
+            if not conversation_context:
+                self._cache_answer(question_embedding, scope, answer, sources,
+                                   {result['document_id'] for result in top_results}, cache_generation)
+            
             return {
                 'success': True,
                 'question': question,
                 'answer': answer,
-                'sources': [
-                    {
-                        'document_name': result['document_name'],
-                        'similarity': result['similarity'],
-                        'chunk_preview': result['chunk_text'][:200] + "..." if len(result['chunk_text']) > 200 else result['chunk_text'],
-                        'page_number': result.get('page_number')
-                    }
-                    for result in top_results
-                ],
-                'timestamp': datetime.now().isoformat()
+                'sources': sources,
+                'timestamp': now_iso
             }
             
         except Exception as e:
@@ -254,24 +485,40 @@ class QAEngine:
                 'message': f"Failed to answer question: {str(e)}"
             }
     
-    def _prepare_context(self, search_results: List[Dict[str, Any]]) -> str:
+    def _prepare_context(self, search_results: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
         """
-        Prepare context text from search results
+        Prepare context text and the response's source list from search results,
+        keeping the context within MAX_CONTEXT_TOKENS
         
         Args:
-            search_results (List[Dict[str, Any]]): Search results from vector database
+            search_results (List[Dict[str, Any]]): Search results, most similar first
             
         Returns:
-            str: Formatted context text
+            Tuple[str, List[Dict[str, Any]]]: Formatted context text and summaries of the sources it includes
         """
         context_parts = []
+        sources = []
+        budget_chars = MAX_CONTEXT_TOKENS * CHARS_PER_TOKEN
         
         for i, result in enumerate(search_results, 1):
-            context_parts.append(f"Source {i} (from {result['document_name']}):")
-            context_parts.append(result['chunk_text'])
-            context_parts.append("")  # Empty line between sources
+            chunk_text = result['chunk_text']
+            part = f"Source {i} (from {result['document_name']}):\n{chunk_text}\n"
+            if len(part) > budget_chars:
+                if context_parts:
+                    logger.debug(f"Context budget reached; dropped {len(search_results) - i + 1} of {len(search_results)} sources")
+                    break
+                # Always keep the best source, cut down to the budget
+                part = part[:budget_chars]
+            budget_chars -= len(part) + 1  # +1 for the joining newline
+            context_parts.append(part)
+            sources.append({
+                'document_name': result['document_name'],
+                'similarity': result['similarity'],
+                'chunk_preview': chunk_text if len(chunk_text) <= 200 else chunk_text[:200] + "...",
+                'page_number': result.get('page_number')
+            })
         
-        return "\n".join(context_parts)
+        return "\n".join(context_parts), sources
     
     def _format_conversation_history(self, history: List[Dict[str, Any]]) -> str:
         """
@@ -394,7 +641,7 @@ class QAEngine:
         """
         try:
             # Generate embedding for query
-            query_embedding = self.embedding_manager.generate_single_embedding(query)
+            query_embedding = self._question_embedding(query)
             
             # Search in vector database
             results = self.vector_db.search_similar(query_embedding, top_k=top_k)
@@ -413,8 +660,7 @@ class QAEngine:
             file_path (str): Path to export file
         """
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, indent=2, ensure_ascii=False)
+            write_json(self.conversation_history, file_path)
             logger.info(f"Conversation history exported to {file_path}")
         except Exception as e:
             logger.error(f"Error exporting conversation history: {str(e)}")
@@ -10,14 +10,141 @@ from pathlib import Path
 import pickle
 from datetime import datetime
 import uuid
+import atexit
+import threading
+import time
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    faiss = None
+
+try:
+    from kernels import top_k_cosine
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    top_k_cosine = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    pa = None
+    pq = None
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+HNSW_MIN_CHUNKS = 10000  # below this an exact flat index is fast enough
+HNSW_NEIGHBORS = 32
+INITIAL_CAPACITY = 1024  # embedding rows allocated on first insert
+COMPACT_DEAD_FRACTION = 0.3  # compact once this share of chunks is tombstoned
+QUANTIZED_MIN_CHUNKS = 10000  # below this an exact float32 scan is cheap enough
+QUANTIZED_BLOCK_ROWS = 4096  # int8 rows widened to float32 at a time during a scan
+RERANK_FACTOR = 4  # int8 shortlist size as a multiple of top_k, reranked in float32
+SAVE_DEBOUNCE_SECONDS = 0.5  # changes within this window are written together
+SAVE_RETRY_MAX_SECONDS = 60  # cap on the backoff between retries of a failing save
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return vectors as a C-contiguous float32 array with unit-norm rows"""
+    vectors = np.array(vectors, dtype=np.float32, order='C')
+    if vectors.size == 0:
+        return vectors
+    vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12
+    return vectors
+
+def write_json(obj: Any, path) -> None:
+    """Write obj as indented UTF-8 JSON, with orjson when installed; unknown types become strings"""
+    if ORJSON_AVAILABLE:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str)
+    else:
+        data = json.dumps(obj, indent=2, ensure_ascii=False, default=str).encode('utf-8')
+    Path(path).write_bytes(data)
+
+def _replace_file(path: Path, write) -> None:
+    """Write through a temporary sibling file and swap it in, so readers never see a partial file"""
+    tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _quantize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization; returns (int8 rows, float32 scales)"""
+    scales = (np.abs(vectors).max(axis=1) / 127.0).astype(np.float32) + 1e-12
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales
+
+def _rows_to_table(rows: List[Dict[str, Any]], leading: Optional[Dict[str, list]] = None):
+    """Columnar table over dict rows; keys missing from a row become nulls"""
+    columns = dict(leading or {})
+    for key in dict.fromkeys(key for row in rows for key in row):
+        columns[key] = [row.get(key) for row in rows]
+    return pa.table(columns)
+
+def _documents_to_tables(documents: List[Dict[str, Any]]):
+    """Split documents into a per-document metadata table and a per-chunk table"""
+    doc_rows = [{k: v for k, v in doc.items() if k != 'chunks'} for doc in documents]
+    chunk_rows = [chunk for doc in documents for chunk in doc['chunks']]
+    doc_idx = [i for i, doc in enumerate(documents) for _ in doc['chunks']]
+    return (
+        _rows_to_table(doc_rows),
+        _rows_to_table(chunk_rows, {'doc_idx': pa.array(doc_idx, type=pa.int32())})
+    )
+
+def _documents_from_tables(docs_tbl, chunks_tbl) -> List[Dict[str, Any]]:
+    """Rebuild document dicts from the tables written by _documents_to_tables"""
+    # A null '_deleted' only means the document was never tombstoned; other None fields are real values
+    documents = [
+        {k: v for k, v in row.items() if not (k == '_deleted' and v is None)}
+        for row in docs_tbl.to_pylist()
+    ]
+    chunk_columns = [name for name in chunks_tbl.column_names if name != 'doc_idx']
+    chunk_rows = chunks_tbl.select(chunk_columns).to_pylist()
+    
+    # Chunks are stored in document order, so each document takes the next chunk_count rows
+    offset = 0
+    for doc in documents:
+        doc['chunks'] = chunk_rows[offset:offset + doc['chunk_count']]
+        offset += doc['chunk_count']
+    return documents
+
+class _ChunkArray:
+    """Per-chunk array kept in a buffer with the embeddings' capacity; reads see only the live rows"""
+    
+    def __set_name__(self, owner, name):
+        self.buffer_name = f"{name}_buffer"
+    
+    def __get__(self, db, owner=None):
+        if db is None:
+            return self
+        buffer = getattr(db, self.buffer_name)
+        return None if buffer is None else buffer[:db._n_chunks]
+    
+    def __set__(self, db, value):
+        setattr(db, self.buffer_name, value)
+
 class VectorDatabase:
     """
     Simple vector database for document storage and retrieval
     """
     
+    # Grown together with the embedding buffer, so appends never copy existing rows
+    chunk_to_doc_idx = _ChunkArray()
+    chunk_local_idx = _ChunkArray()
+    _alive = _ChunkArray()
+    _embeddings_q = _ChunkArray()
+    _q_scales = _ChunkArray()
+    
     def __init__(self, db_path: str = "./vector_db"):
         """
         Initialize the vector database
@@ -30,14 +157,31 @@ class VectorDatabase:
         
         # Database files
         self.metadata_file = self.db_path / "metadata.json"
-        self.embeddings_file = self.db_path / "embeddings.pkl"
+        self.embeddings_file = self.db_path / "embeddings.npy"
+        self.legacy_embeddings_file = self.db_path / "embeddings.pkl"
         self.documents_file = self.db_path / "documents.pkl"
+        self.documents_table_file = self.db_path / "documents.parquet"
+        self.chunks_table_file = self.db_path / "chunks.parquet"
+        self.faiss_index_file = self.db_path / "faiss.index"
         
         # In-memory storage
         self.metadata = {}
-        self.embeddings = np.array([])
+        self.embeddings = np.empty((0, 0), dtype=np.float32)  # Unit-norm rows, so dot product == cosine
         self.documents = []
         self.document_index = {}  # Maps document_id to index
+        self.chunk_to_doc_idx = np.empty(0, dtype=np.int32)  # Global chunk index -> document index
+        self.chunk_local_idx = np.empty(0, dtype=np.int32)  # Global chunk index -> chunk index within its document
+        self._alive = np.empty(0, dtype=bool)  # False for chunks of removed (tombstoned) documents
+        self._doc_chunk_offsets = []  # Document index -> global index of its first chunk
+        self._stats = {'total_chunks': 0, 'total_words': 0, 'total_size': 0}  # Totals over live documents
+        self.faiss_index = None  # Built lazily on first search
+        
+        # Background persistence: mutations set the event, the save thread coalesces them
+        self._lock = threading.RLock()
+        self._save_event = threading.Event()
+        self._save_thread = None
+        self._save_failures = 0  # consecutive failed saves
+        self.last_save_error: Optional[str] = None
         
         # Load existing data
         self._load_database()
@@ -47,22 +191,34 @@ class VectorDatabase:
         try:
             # Load metadata
             if self.metadata_file.exists():
-                with open(self.metadata_file, 'r') as f:
+                with open(self.metadata_file, 'r', encoding='utf-8') as f:
                     self.metadata = json.load(f)
             
-            # Load embeddings
+            # Load embeddings; the .npy file is memory-mapped, so rows are paged in on demand
             if self.embeddings_file.exists():
-                with open(self.embeddings_file, 'rb') as f:
-                    self.embeddings = pickle.load(f)
+                self.embeddings = np.load(self.embeddings_file, mmap_mode='r')
+            elif self.legacy_embeddings_file.exists():
+                with open(self.legacy_embeddings_file, 'rb') as f:
+                    self.embeddings = _normalize_rows(pickle.load(f))
             
-            # Load documents
-            if self.documents_file.exists():
+            # Load documents from the columnar tables, falling back to the pickle
+            if PYARROW_AVAILABLE and self.documents_table_file.exists() and self.chunks_table_file.exists():
+                self.documents = _documents_from_tables(
+                    pq.read_table(self.documents_table_file), pq.read_table(self.chunks_table_file)
+                )
+            elif self.documents_file.exists():
                 with open(self.documents_file, 'rb') as f:
                     self.documents = pickle.load(f)
             
             # Rebuild document index
             self._rebuild_index()
             
+            # Reuse the persisted ANN index if it still matches the embeddings
+            if FAISS_AVAILABLE and self.faiss_index_file.exists():
+                index = faiss.read_index(str(self.faiss_index_file))
+                if index.ntotal == len(self.embeddings):
+                    self.faiss_index = index
+            
             logger.info(f"Loaded database with {len(self.documents)} documents")
             
         except Exception as e:
@@ -79,19 +235,34 @@ class VectorDatabase:
         try:
             # Update metadata
             self.metadata['last_updated'] = datetime.now().isoformat()
-            self.metadata['document_count'] = len(self.documents)
+            self.metadata['document_count'] = len(self.document_index)
             
             # Save metadata
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
+            _replace_file(self.metadata_file, lambda path: write_json(self.metadata, path))
             
-            # Save embeddings
-            with open(self.embeddings_file, 'wb') as f:
-                pickle.dump(self.embeddings, f)
+            # Save embeddings; the swap also keeps a still memory-mapped old file intact
+            _replace_file(self.embeddings_file, lambda path: np.save(path, self.embeddings))
+            if self.legacy_embeddings_file.exists():
+                self.legacy_embeddings_file.unlink()
             
-            # Save documents
-            with open(self.documents_file, 'wb') as f:
-                pickle.dump(self.documents, f)
+            # Save documents as Parquet tables when pyarrow is installed
+            if PYARROW_AVAILABLE:
+                docs_tbl, chunks_tbl = _documents_to_tables(self.documents)
+                _replace_file(self.documents_table_file, lambda path: pq.write_table(docs_tbl, path))
+                _replace_file(self.chunks_table_file, lambda path: pq.write_table(chunks_tbl, path))
+                if self.documents_file.exists():
+                    self.documents_file.unlink()
+            else:
+                def write_pickle(path):
+                    with open(path, 'wb') as f:
+                        pickle.dump(self.documents, f)
+                _replace_file(self.documents_file, write_pickle)
+            
+            # Save the ANN index, or drop a stale one so it is rebuilt on load
+            if self.faiss_index is not None:
+                _replace_file(self.faiss_index_file, lambda path: faiss.write_index(self.faiss_index, str(path)))
+            elif self.faiss_index_file.exists():
+                self.faiss_index_file.unlink()
             
             logger.info("Database saved successfully")
             
@@ -99,11 +270,179 @@ class VectorDatabase:
             logger.error(f"Error saving database: {str(e)}")
             raise
     
+    def _schedule_save(self):
+        """Ask the background thread to save soon, starting it on first use"""
+        if self._save_thread is None:
+            self._save_thread = threading.Thread(target=self._save_loop, name="vector-db-save", daemon=True)
+            self._save_thread.start()
+            atexit.register(self.close)
+        self._save_event.set()
+    
+    def _save_pending(self):
+        """Save under the lock; on failure the changes stay pending and the failure is recorded"""
+        self._save_event.clear()
+        try:
+            self._save_database()
+        except Exception as e:
+            self._save_failures += 1
+            self.last_save_error = str(e)
+            self._save_event.set()
+            raise
+        self._save_failures = 0
+        self.last_save_error = None
+    
+    def _save_loop(self):
+        """Wait for changes, let a burst settle, then save once; failed saves are retried with backoff"""
+        while True:
+            self._save_event.wait()
+            time.sleep(SAVE_DEBOUNCE_SECONDS)
+            retry_delay = 0
+            with self._lock:
+                if not self._save_event.is_set():
+                    continue  # flushed in the meantime
+                try:
+                    self._save_pending()
+                except Exception:
+                    retry_delay = min(SAVE_DEBOUNCE_SECONDS * 2 ** self._save_failures, SAVE_RETRY_MAX_SECONDS)
+                    logger.error(f"Background save failed {self._save_failures} time(s) in a row; "
+                                 f"retrying in {retry_delay:.1f}s")
+            if retry_delay:
+                time.sleep(retry_delay)
+    
+    def flush(self):
+        """Write any pending changes now, waiting for an in-progress background save"""
+        with self._lock:
+            if self._save_event.is_set():
+                self._save_pending()
+    
+    def close(self):
+        """Write pending changes synchronously; also runs at interpreter exit"""
+        self.flush()
+    
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Live rows of the embedding buffer"""
+        return self._embedding_buffer[:self._n_chunks]
+    
+    @embeddings.setter
+    def embeddings(self, value: np.ndarray):
+        """Replace the buffer with exactly the given rows"""
+        self._embedding_buffer = value
+        self._n_chunks = len(value)
+        self._capacity = len(value)
+        self._dim = value.shape[1] if value.ndim == 2 and len(value) else None
+        self._embeddings_q = None  # int8 copy for large scans, built lazily
+        self._q_scales = None
+    
+    def _append_chunks(self, embeddings: np.ndarray, doc_index: int):
+        """
+        Append one document's chunk rows to the embedding and per-chunk buffers,
+        doubling their capacity when full so inserts are amortized O(1)
+        """
+        k, d = embeddings.shape
+        if self._dim is None:
+            self._dim = d
+            self._capacity = max(INITIAL_CAPACITY, k)
+            self._embedding_buffer = np.empty((self._capacity, d), dtype=np.float32)
+            self._n_chunks = 0
+        
+        # A memory-mapped buffer is read-only, so the first append copies it into memory
+        if self._n_chunks + k > self._capacity or not self._embedding_buffer.flags.writeable:
+            while self._n_chunks + k > self._capacity:
+                self._capacity *= 2
+            grown = np.empty((self._capacity, d), dtype=np.float32)
+            grown[:self._n_chunks] = self._embedding_buffer[:self._n_chunks]
+            self._embedding_buffer = grown
+        
+        n = self._n_chunks
+        self._embedding_buffer[n:n + k] = embeddings
+        
+        quantized, scales = (None, None) if self._embeddings_q is None else _quantize_rows(embeddings)
+        per_chunk_rows = {
+            'chunk_to_doc_idx': doc_index,
+            'chunk_local_idx': np.arange(k, dtype=np.int32),
+            '_alive': True,
+            '_embeddings_q': quantized,
+            '_q_scales': scales
+        }
+        for name, rows in per_chunk_rows.items():
+            buffer = getattr(self, f"{name}_buffer")
+            if buffer is None:
+                continue  # int8 copy not built yet
+            if len(buffer) < n + k:
+                grown = np.empty((self._capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+                grown[:n] = buffer[:n]
+                buffer = grown
+                setattr(self, f"{name}_buffer", buffer)
+            buffer[n:n + k] = rows
+        self._n_chunks += k
+    
     def _rebuild_index(self):
         """Rebuild the document index"""
         self.document_index = {}
         for i, doc in enumerate(self.documents):
-            self.document_index[doc['document_id']] = i
+            if not doc.get('_deleted'):
+                self.document_index[doc['document_id']] = i
+        
+        chunk_counts = np.array([doc['chunk_count'] for doc in self.documents], dtype=np.int64)
+        self.chunk_to_doc_idx = np.repeat(np.arange(len(self.documents), dtype=np.int32), chunk_counts)
+        offsets = np.cumsum(chunk_counts) - chunk_counts
+        self._doc_chunk_offsets = offsets.tolist()
+        self.chunk_local_idx = (
+            np.arange(chunk_counts.sum(), dtype=np.int32)
+            - np.repeat(offsets, chunk_counts).astype(np.int32)
+        )
+        self._alive = np.repeat(
+            np.array([not doc.get('_deleted') for doc in self.documents], dtype=bool), chunk_counts
+        )
+        
+        live_documents = self._live_documents()
+        self._stats = {
+            'total_chunks': sum(doc['chunk_count'] for doc in live_documents),
+            'total_words': sum(doc['word_count'] for doc in live_documents),
+            'total_size': sum(doc['file_size'] for doc in live_documents)
+        }
+    
+    def _update_stats(self, document: Dict[str, Any], sign: int):
+        """Add (sign=1) or subtract (sign=-1) a document's counts from the running totals"""
+        self._stats['total_chunks'] += sign * document['chunk_count']
+        self._stats['total_words'] += sign * document['word_count']
+        self._stats['total_size'] += sign * document['file_size']
+    
+    def _document_chunks(self, doc_index: int) -> np.ndarray:
+        """Global chunk indices of one document, which are always contiguous"""
+        start = self._doc_chunk_offsets[doc_index]
+        return np.arange(start, start + self.documents[doc_index]['chunk_count'])
+    
+    def _live_documents(self) -> List[Dict[str, Any]]:
+        """Documents that have not been tombstoned"""
+        return [doc for doc in self.documents if not doc.get('_deleted')]
+    
+    def compact(self):
+        """Physically drop tombstoned documents and their embeddings"""
+        if self._alive.all():
+            return
+        
+        self.embeddings = self.embeddings[self._alive]
+        self.documents = self._live_documents()
+        self._rebuild_index()
+        self.faiss_index = None
+        logger.info("Compacted vector database")
+    
+    def _get_faiss_index(self):
+        """Return the ANN index over all embeddings, building it if needed"""
+        if not FAISS_AVAILABLE or len(self.embeddings) == 0:
+            return None
+        
+        if self.faiss_index is None:
+            dimension = self.embeddings.shape[1]
+            if len(self.embeddings) >= HNSW_MIN_CHUNKS:
+                index = faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexFlatIP(dimension)
+            index.add(self.embeddings)
+            self.faiss_index = index
+        return self.faiss_index
     
     def add_document(self, document_data: Dict[str, Any], chunks: List[Dict[str, Any]], 
                     embeddings: np.ndarray) -> str:
@@ -136,21 +475,24 @@ class VectorDatabase:
             'chunks': chunks
         }
         
-        # Add to documents list
-        start_index = len(self.documents)
-        self.documents.append(document_entry)
-        
-        # Add embeddings
-        if len(self.embeddings) == 0:
-            self.embeddings = embeddings
-        else:
-            self.embeddings = np.vstack([self.embeddings, embeddings])
-        
-        # Update document index
-        self.document_index[document_id] = start_index
-        
-        # Save to disk
-        self._save_database()
+        with self._lock:
+            # Add to documents list
+            start_index = len(self.documents)
+            self.documents.append(document_entry)
+            self._doc_chunk_offsets.append(self._n_chunks)
+            self._update_stats(document_entry, 1)
+            
+            # Add embeddings and their per-chunk lookups
+            embeddings = _normalize_rows(embeddings)
+            self._append_chunks(embeddings, start_index)
+            
+            # Update document index
+            self.document_index[document_id] = start_index
+            if self.faiss_index is not None:
+                self.faiss_index.add(embeddings)
+            
+            # Persist in the background; bursts of inserts share one write
+            self._schedule_save()
         
         logger.info(f"Added document {document_data['file_name']} with {len(chunks)} chunks")
         return document_id
@@ -165,29 +507,31 @@ class VectorDatabase:
         Returns:
             bool: True if document was removed, False if not found
         """
-        if document_id not in self.document_index:
-            logger.warning(f"Document {document_id} not found")
-            return False
-        
-        # Get document info
-        doc_index = self.document_index[document_id]
-        document = self.documents[doc_index]
-        chunk_count = document['chunk_count']
-        
-        # Remove embeddings
-        start_idx = sum(doc['chunk_count'] for doc in self.documents[:doc_index])
-        end_idx = start_idx + chunk_count
-        
-        self.embeddings = np.delete(self.embeddings, slice(start_idx, end_idx), axis=0)
-        
-        # Remove document
-        del self.documents[doc_index]
-        
-        # Rebuild index
-        self._rebuild_index()
-        
-        # Save to disk
-        self._save_database()
+        with self._lock:
+            if document_id not in self.document_index:
+                logger.warning(f"Document {document_id} not found")
+                return False
+            
+            # Get document info
+            doc_index = self.document_index[document_id]
+            document = self.documents[doc_index]
+            chunk_count = document['chunk_count']
+            
+            # Tombstone the chunks; rows stay in place until compaction
+            start_idx = self._doc_chunk_offsets[doc_index]
+            end_idx = start_idx + chunk_count
+            self._alive[start_idx:end_idx] = False
+            
+            # Tombstone the document
+            document['_deleted'] = True
+            self.document_index.pop(document_id)
+            self._update_stats(document, -1)
+            
+            if len(self._alive) and (~self._alive).mean() > COMPACT_DEAD_FRACTION:
+                self.compact()
+            
+            # Persist in the background; bursts of removals share one write
+            self._schedule_save()
         
         logger.info(f"Removed document {document_id}")
         return True
@@ -208,56 +552,120 @@ class VectorDatabase:
         if len(self.embeddings) == 0:
             return []
         
-        # Compute similarities
-        similarities = np.dot(self.embeddings, query_embedding)
+        # Resolve the filter once to a document index
+        wanted_doc = None
+        if document_filter:
+            if document_filter not in self.document_index:
+                return []
+            wanted_doc = self.document_index[document_filter]
+        
+        index = self._get_faiss_index()
+        if index is not None:
+            top_indices, top_scores = self._faiss_search(index, query_embedding, top_k, wanted_doc)
+        else:
+            top_indices, top_scores = self._numpy_search(query_embedding, top_k, wanted_doc)
+        if len(top_indices) == 0:
+            return []
         
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        doc_indices = self.chunk_to_doc_idx[top_indices]
+        local_indices = self.chunk_local_idx[top_indices]
         
         results = []
-        current_chunk_idx = 0
-        
-        for doc in self.documents:
-            # Skip if document filter is specified
-            if document_filter and doc['document_id'] != document_filter:
-                current_chunk_idx += doc['chunk_count']
-                continue
-            
-            # Check if any chunks from this document are in top results
-            doc_chunk_indices = range(current_chunk_idx, current_chunk_idx + doc['chunk_count'])
+        for doc_idx, local_chunk_idx, similarity in zip(doc_indices, local_indices, top_scores):
+            doc = self.documents[doc_idx]
+            chunk = doc['chunks'][local_chunk_idx]
             
-            for chunk_idx in top_indices:
-                if chunk_idx in doc_chunk_indices:
-                    # Get the chunk
-                    local_chunk_idx = chunk_idx - current_chunk_idx
-                    chunk = doc['chunks'][local_chunk_idx]
-                    
-                    # Calculate similarity
-                    similarity = float(similarities[chunk_idx])
-                    
-                    result = {
-                        'document_id': doc['document_id'],
-                        'document_name': doc['file_name'],
-                        'chunk_id': chunk['chunk_id'],
-                        'chunk_text': chunk['text'],
-                        'similarity': similarity,
-                        'chunk_metadata': {
-                            'start_pos': chunk['start_pos'],
-                            'end_pos': chunk['end_pos'],
-                            'length': chunk['length'],
-                            'page_number': chunk.get('page_number')
-                        },
-                        'page_number': chunk.get('page_number')
-                    }
-                    
-                    results.append(result)
-            
-            current_chunk_idx += doc['chunk_count']
-        
-        # Sort by similarity
-        results.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        return results[:top_k]
+            results.append({
+                'document_id': doc['document_id'],
+                'document_name': doc['file_name'],
+                'chunk_id': chunk['chunk_id'],
+                'chunk_text': chunk['text'],
+                'similarity': float(similarity),
+                'chunk_metadata': {
+                    'start_pos': chunk['start_pos'],
+                    'end_pos': chunk['end_pos'],
+                    'length': chunk['length'],
+                    'page_number': chunk.get('page_number')
+                },
+                'page_number': chunk.get('page_number')
+            })
+        
+        return results
+    
+    def _numpy_search(self, query_embedding: np.ndarray, top_k: int,
+                      wanted_doc: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search over live (or one document's) chunks; large scans shortlist with int8 first"""
+        query = _normalize_rows(query_embedding)
+        if wanted_doc is not None:
+            candidates = self._document_chunks(wanted_doc)
+        else:
+            candidates = np.flatnonzero(self._alive)
+        
+        k = min(top_k, len(candidates))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        # A contiguous candidate range (one document, or everything when nothing is tombstoned)
+        # is a view of the matrix, so the compiled kernel scans it without a gather or temporary
+        if NUMBA_AVAILABLE and len(candidates) < QUANTIZED_MIN_CHUNKS and candidates[-1] - candidates[0] + 1 == len(candidates):
+            start = int(candidates[0])
+            rows = np.asarray(self.embeddings[start:start + len(candidates)])
+            top_indices, top_scores = top_k_cosine(rows, query, k)
+            return top_indices + start, top_scores
+        
+        # Shortlist with the int8 copy (a quarter of the bytes), then rerank in float32
+        shortlist_size = k * RERANK_FACTOR
+        if wanted_doc is None and len(candidates) >= max(QUANTIZED_MIN_CHUNKS, shortlist_size):
+            approx_scores = self._approximate_scores(query)[candidates]
+            candidates = candidates[np.argpartition(approx_scores, -shortlist_size)[-shortlist_size:]]
+        
+        # Partition out the top-k, then sort only those k
+        candidate_scores = self.embeddings[candidates] @ query
+        part = np.argpartition(candidate_scores, -k)[-k:]
+        part = part[np.argsort(-candidate_scores[part], kind='stable')]
+        return candidates[part], candidate_scores[part]
+    
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine scores for every chunk from the int8 embeddings"""
+        if self._embeddings_q is None:
+            self._embeddings_q, self._q_scales = _quantize_rows(self.embeddings)
+        
+        scores = np.empty(len(self._embeddings_q), dtype=np.float32)
+        for start in range(0, len(scores), QUANTIZED_BLOCK_ROWS):
+            stop = start + QUANTIZED_BLOCK_ROWS
+            scores[start:stop] = self._embeddings_q[start:stop].astype(np.float32) @ query
+        scores *= self._q_scales
+        return scores
+    
+    def _faiss_search(self, index, query_embedding: np.ndarray, top_k: int,
+                      wanted_doc: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the ANN index, restricting to one document's chunks inside the index when filtered"""
+        query = _normalize_rows(query_embedding).reshape(1, -1)
+        
+        selector = None
+        if wanted_doc is not None:
+            # A document's chunks are contiguous, so its ids form one range
+            doc_chunks = self._document_chunks(wanted_doc)
+            if len(doc_chunks) == 0:
+                return doc_chunks, np.empty(0, dtype=np.float32)
+            selector = faiss.IDSelectorRange(int(doc_chunks[0]), int(doc_chunks[-1]) + 1)
+        elif not self._alive.all():
+            # Skip tombstoned chunks inside the index; the bitmap must outlive the search
+            alive_bits = np.packbits(self._alive, bitorder='little')
+            selector = faiss.IDSelectorBitmap(len(self._alive), faiss.swig_ptr(alive_bits))
+        
+        params = None
+        if selector is not None:
+            if isinstance(index, faiss.IndexHNSWFlat):
+                params = faiss.SearchParametersHNSW(sel=selector)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+        
+        scores, indices = index.search(query, min(top_k, index.ntotal), params=params)
+        
+        # FAISS pads with -1 when fewer than top_k candidates match
+        found = indices[0] >= 0
+        return indices[0][found], scores[0][found]
     
     def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -283,7 +691,7 @@ class VectorDatabase:
         """
         documents = []
         
-        for doc in self.documents:
+        for doc in self._live_documents():
             summary = {
                 'document_id': doc['document_id'],
                 'file_name': doc['file_name'],
@@ -304,32 +712,38 @@ class VectorDatabase:
         Returns:
             Dict[str, Any]: Database statistics
         """
-        total_chunks = sum(doc['chunk_count'] for doc in self.documents)
-        total_words = sum(doc['word_count'] for doc in self.documents)
-        total_size = sum(doc['file_size'] for doc in self.documents)
-        
         return {
-            'document_count': len(self.documents),
-            'total_chunks': total_chunks,
-            'total_words': total_words,
-            'total_size_mb': round(total_size / (1024 * 1024), 2),
-            'embedding_dimension': self.embeddings.shape[1] if len(self.embeddings) > 0 else 0,
+            'document_count': len(self.document_index),
+            'total_chunks': self._stats['total_chunks'],
+            'total_words': self._stats['total_words'],
+            'total_size_mb': round(self._stats['total_size'] / (1024 * 1024), 2),
+            'embedding_dimension': self._dim or 0,
             'created_at': self.metadata.get('created_at', 'Unknown'),
-            'last_updated': self.metadata.get('last_updated', 'Unknown')
+            'last_updated': self.metadata.get('last_updated', 'Unknown'),
+            'last_save_error': self.last_save_error
         }
     
     def clear_database(self):
         """Clear all data from the database"""
-        self.metadata = {
-            'created_at': datetime.now().isoformat(),
-            'last_updated': datetime.now().isoformat(),
-            'version': '1.0'
-        }
-        self.embeddings = np.array([])
-        self.documents = []
-        self.document_index = {}
-        
-        self._save_database()
+        with self._lock:
+            self.metadata = {
+                'created_at': datetime.now().isoformat(),
+                'last_updated': datetime.now().isoformat(),
+                'version': '1.0'
+            }
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+            self.documents = []
+            self.document_index = {}
+            self.chunk_to_doc_idx = np.empty(0, dtype=np.int32)
+            self.chunk_local_idx = np.empty(0, dtype=np.int32)
+            self._alive = np.empty(0, dtype=bool)
+            self._doc_chunk_offsets = []
+            self._stats = {'total_chunks': 0, 'total_words': 0, 'total_size': 0}
+            self.faiss_index = None
+            
+            # Supersedes any pending background save
+            self._save_event.clear()
+            self._save_database()
         logger.info("Database cleared")
     
     def export_database(self, export_path: str):
@@ -341,12 +755,11 @@ class VectorDatabase:
         """
         export_data = {
             'metadata': self.metadata,
-            'documents': self.documents,
+            'documents': self._live_documents(),
             'exported_at': datetime.now().isoformat()
         }
         
-        with open(export_path, 'w') as f:
-            json.dump(export_data, f, indent=2, default=str)
+        write_json(export_data, export_path)
         
         logger.info(f"Database exported to {export_path}")
     
@@ -357,18 +770,20 @@ class VectorDatabase:
         Args:
             import_path (str): Path to import file
         """
-        with open(import_path, 'r') as f:
+        with open(import_path, 'r', encoding='utf-8') as f:
             import_data = json.load(f)
         
-        self.metadata = import_data['metadata']
-        self.documents = import_data['documents']
-        
-        # Rebuild index
-        self._rebuild_index()
-        
-        # Note: Embeddings would need to be regenerated
-        logger.warning("Imported documents. Embeddings need to be regenerated.")
-        
-        self._save_database()
+        with self._lock:
+            self.metadata = import_data['metadata']
+            self.documents = import_data['documents']
+            
+            # Rebuild index
+            self._rebuild_index()
+            
+            # Note: Embeddings would need to be regenerated
+            logger.warning("Imported documents. Embeddings need to be regenerated.")
+            
+            self._save_event.clear()
+            self._save_database()
         logger.info(f"Database imported from {import_path}")
 
@@ -7,8 +7,12 @@ import streamlit as st
 import PyPDF2
 import docx
 import tempfile
+import io
 import os
 import re
+import json
+import hashlib
+import uuid
 from datetime import datetime
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -17,10 +21,18 @@ import pyttsx3
 import threading
 import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
 import base64
 
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+    fitz = None
+
 # Load environment variables
 load_dotenv('config.env')
 
@@ -39,18 +51,94 @@ if 'ai_enabled' not in st.session_state:
     st.session_state.ai_enabled = True
 if 'quota_mode' not in st.session_state:
     st.session_state.quota_mode = False
+if 'bm25' not in st.session_state:
+    st.session_state.bm25 = None
+if 'pending_questions' not in st.session_state:
+    st.session_state.pending_questions = []
+if 'answer_cache' not in st.session_state:
+    st.session_state.answer_cache = {}
+if 'corpus_loaded' not in st.session_state:
+    st.session_state.corpus_loaded = False
+
+# BM25 retrieval settings
+BM25_K1 = 1.5
+BM25_B = 0.75
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""a an and are as at be by for from how in is it of on or that the this to was
+what when where which who why with""".split())
+
+# Upper bound on files parsed concurrently during an upload
+MAX_UPLOAD_WORKERS = 4
+
+# Extracted document text persisted across sessions, one JSON file per file content hash;
+# each session's manifest lists the documents it owns, keyed by its ?session= value
+CORPUS_CACHE_DIR = ".cache"
+SESSION_MANIFEST_DIR = os.path.join(CORPUS_CACHE_DIR, "sessions")
+SESSION_ID_PATTERN = re.compile(r"[0-9A-Za-z_-]{1,64}")
+CORPUS_CACHE_MAX_AGE_DAYS = 30
+HASH_CHUNK_SIZE = 1 << 20
+EXTRACT_ERRORS = ("PDF Error:", "DOCX Error:", "Text file error", "Unsupported file type")
+
+# Answers to repeated questions are reused until the documents change
+ANSWER_CACHE_SIZE = 128
+ANSWER_CACHE_TTL_SECONDS = 3600
+
+# Markdown stripped before reading an answer aloud: bold (keeping the text), headers
+# and separators in one pass, then newline runs become periods
+SPEECH_MARKDOWN = re.compile(r'\*\*(.*?)\*\*|#{1,6}\s*|---+')
+SPEECH_NEWLINES = re.compile(r'\n+')
+
+# Lightweight model to reduce quota usage; the first available model is the fallback
+PREFERRED_MODEL = "gemini-2.0-flash-lite"
+
+# Document context for AI answers: best-matching sentences within a token budget
+ANSWER_CONTEXT_SENTENCES = 8
+ANSWER_CONTEXT_MAX_TOKENS = 2000
+CHARS_PER_TOKEN = 4  # rough estimate; avoids a count_tokens round trip
+
+# Static prompt instructions; they lead every prompt so Gemini's implicit
+# prefix cache can reuse them, and the question always comes last
+ANSWER_INSTRUCTIONS = """Answer the question based on the documents below.
+Answer briefly and cite the source document.
+
+"""
+INSIGHTS_INSTRUCTIONS = """Based on the document content below, provide additional insights and analysis for the question:
+1. Additional context or background information
+2. Related concepts or implications
+3. Potential follow-up questions
+4. Key takeaways
+
+Keep it concise and relevant.
+
+"""
+BATCH_INSTRUCTIONS = """Answer each numbered question separately, using only its own excerpts.
+Return a JSON array with one object per question: {"q": <question number>, "a": "<insights>"}.
+
+"""
+GENERAL_INSTRUCTIONS = """Answer the question with general knowledge.
+Provide a helpful, accurate answer. Keep it concise and informative.
+
+"""
 
 def extract_text(file):
     """Extract text from file"""
     file_ext = os.path.splitext(file.name)[1].lower()
     
     if file_ext == '.pdf':
+        # Materialize the upload once; parsers then work on plain in-memory bytes
+        data = file.read()
+        if PYMUPDF_AVAILABLE:
+            try:
+                pdf = fitz.open(stream=data, filetype="pdf")
+                try:
+                    return "\n".join(page.get_text("text") for page in pdf)
+                finally:
+                    pdf.close()
+            except Exception:
+                pass  # fall back to PyPDF2 below
         try:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+            return "".join((page.extract_text() or "") + "\n" for page in pdf_reader.pages)
         except Exception as e:
             return f"PDF Error: {str(e)}"
     
@@ -62,69 +150,243 @@ def extract_text(file):
     
     elif file_ext in ['.docx', '.doc']:
         try:
-            doc = docx.Document(file)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            doc = docx.Document(io.BytesIO(file.read()))
+            return "".join(paragraph.text + "\n" for paragraph in doc.paragraphs)
         except Exception as e:
             return f"DOCX Error: {str(e)}"
     
     else:
         return "Unsupported file type"
 
-def search_documents(question):
-    """Search documents for relevant content"""
-    results = []
-    for doc in st.session_state.documents:
-        if question.lower() in doc['text'].lower():
-            sentences = doc['text'].split('.')
-            for sentence in sentences:
-                if question.lower() in sentence.lower():
-                    results.append({
-                        'document': doc['name'],
-                        'text': sentence.strip(),
-                        'relevance': sentence.lower().count(question.lower())
-                    })
+def tokenize(text):
+    """Lowercase word tokens without punctuation or stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+def split_sentences(text):
+    """Split text into non-empty sentences"""
+    return [s.strip() for s in text.split('.') if s.strip()]
+
+def make_document(name, text, content_hash, uploaded_at=None):
+    """Document entry with the sentences and tokens search needs"""
+    sentences = split_sentences(text)
+    return {
+        'name': name,
+        'text': text,
+        'sentences': sentences,
+        'tokens': [tokenize(sentence) for sentence in sentences],
+        'word_count': len(text.split()),
+        'uploaded_at': uploaded_at or datetime.now().strftime("%H:%M:%S"),
+        'hash': content_hash
+    }
+
+def corpus_cache_path(content_hash):
+    """Cache file for an uploaded file's content"""
+    return os.path.join(CORPUS_CACHE_DIR, f"{content_hash}.json")
+
+def file_sha256(file):
+    """SHA-256 of an uploaded file, read in chunks; leaves the file at its start"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+def load_or_extract(file):
+    """
+    Extract text from an uploaded file, reusing the persisted text for content seen before.
+    Returns (text, content_hash).
+    """
+    content_hash = file_sha256(file)
+    path = corpus_cache_path(content_hash)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = json.load(f)['text']
+        os.utime(path)  # recently used entries are kept
+        return text, content_hash
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    text = extract_text(file)
+    if not text.startswith(EXTRACT_ERRORS):
+        try:
+            os.makedirs(CORPUS_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'text': text}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # persistence is best effort
+    return text, content_hash
+
+def corpus_session_id():
+    """
+    Documents are restored for every tab opened with the same ?session= value;
+    a visit without a usable one gets a fresh random ID written back to the URL
+    """
+    session_id = st.query_params.get('session')
+    if not session_id or not SESSION_ID_PATTERN.fullmatch(session_id):
+        session_id = uuid.uuid4().hex
+        st.query_params['session'] = session_id
+    return session_id
+
+def manifest_path(session_id):
+    """Manifest file listing a session's documents"""
+    return os.path.join(SESSION_MANIFEST_DIR, f"{session_id}.json")
+
+def save_manifest(documents):
+    """Record which documents this session owns; persistence is best effort"""
+    path = manifest_path(corpus_session_id())
+    try:
+        os.makedirs(SESSION_MANIFEST_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([{'name': d['name'], 'hash': d['hash'], 'uploaded_at': d['uploaded_at']} for d in documents], f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def prune_corpus_cache():
+    """Delete cached texts and session manifests unused for too long"""
+    cutoff = time.time() - CORPUS_CACHE_MAX_AGE_DAYS * 86400
+    for directory in (CORPUS_CACHE_DIR, SESSION_MANIFEST_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+def load_corpus():
+    """Documents this session uploaded in earlier runs; stale cache entries are deleted"""
+    prune_corpus_cache()
+    path = manifest_path(corpus_session_id())
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        return []
+    
+    documents = []
+    for item in manifest:
+        try:
+            text_path = corpus_cache_path(item['hash'])
+            with open(text_path, 'r', encoding='utf-8') as f:
+                text = json.load(f)['text']
+            os.utime(text_path)  # recently used entries are kept
+            documents.append(make_document(item['name'], text, item['hash'], item.get('uploaded_at')))
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+    return documents
+
+def build_bm25_index(documents):
+    """Build BM25 posting lists over every sentence of every document"""
+    sentences = []  # (document name, sentence text)
+    lengths = []
+    term_counts = {}  # term -> {sentence id: term frequency}
+    for doc in documents:
+        for sentence, tokens in zip(doc['sentences'], doc['tokens']):
+            sentence_id = len(sentences)
+            sentences.append((doc['name'], sentence))
+            lengths.append(len(tokens))
+            for token in tokens:
+                postings = term_counts.setdefault(token, {})
+                postings[sentence_id] = postings.get(sentence_id, 0) + 1
+    
+    n = len(sentences)
+    lengths = np.array(lengths, dtype=np.float32)
+    # Length normalization is fixed per sentence, so fold it in once
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean() if n else 0.0, 1.0))
+    postings = {}
+    for term, counts in term_counts.items():
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        idf = np.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+        postings[term] = (ids, idf * tf * (BM25_K1 + 1) / (tf + norm[ids]))
+    
+    return {'sentences': sentences, 'postings': postings}
+
+def rebuild_index():
+    """Rebuild the cached BM25 index; call whenever documents are added or removed"""
+    st.session_state.bm25 = build_bm25_index(st.session_state.documents)
+    st.session_state.answer_cache = {}
+
+def search_documents(question, top_k=5):
+    """Search documents for relevant content, ranked by BM25"""
+    if st.session_state.bm25 is None:
+        rebuild_index()
+    index = st.session_state.bm25
+    postings = [index['postings'][term] for term in set(tokenize(question)) if term in index['postings']]
+    if not postings:
+        return []
+    
+    # Score only the sentences on the query terms' posting lists, not the whole corpus
+    if len(postings) == 1:
+        candidates, scores = postings[0]
+    else:
+        candidates, inverse = np.unique(np.concatenate([ids for ids, _ in postings]), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate([weights for _, weights in postings])).astype(np.float32)
+    
+    order = np.arange(len(candidates))
+    if len(order) > top_k:
+        order = np.argpartition(-scores, top_k)[:top_k]
+    order = order[np.argsort(-scores[order], kind='stable')]
     
-    results.sort(key=lambda x: x['relevance'], reverse=True)
-    return results[:5]
+    results = []
+    for i in order:
+        name, sentence = index['sentences'][candidates[i]]
+        results.append({
+            'document': name,
+            'text': sentence,
+            'relevance': round(float(scores[i]), 2)
+        })
+    return results
+
+def retrieval_context(results):
+    """Top search results as document blocks for the prompt, capped at ANSWER_CONTEXT_MAX_TOKENS"""
+    budget = ANSWER_CONTEXT_MAX_TOKENS * CHARS_PER_TOKEN
+    blocks = []
+    for result in results:
+        if budget <= 0:
+            break
+        block = f"Document: {result['document']}\nContent: {result['text']}"[:budget]
+        blocks.append(block)
+        budget -= len(block) + 2
+    return "\n\n".join(blocks)
+
+@st.cache_data(show_spinner=False)
+def list_generation_models():
+    """Gemini models supporting generateContent; listed once and shared across reruns"""
+    return [m.name.split('/')[-1] for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+def pick_model():
+    """Preferred lightweight Gemini model, else the first available one; None if there are none"""
+    available = list_generation_models()
+    if not available:
+        list_generation_models.clear()  # list again on the next call
+        return None
+    return PREFERRED_MODEL if PREFERRED_MODEL in available else available[0]
 
-def generate_ai_answer(question, relevant_content):
+def generate_ai_answer(question, relevant_content=None):
     """Generate AI answer using Google Gemini with quota handling"""
     try:
-        # Get available models
-        models = genai.list_models()
-        available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
-        
-        if not available_models:
+        model_name = pick_model()
+        if model_name is None:
             return "No AI models available"
         
-        # Use a lightweight model to reduce quota usage
-        model_name = "gemini-2.0-flash-lite"  # Use a lighter model
-        if model_name not in [m.split('/')[-1] for m in available_models]:
-            model_name = available_models[0].split('/')[-1]  # Fallback to first available
-        
         model = genai.GenerativeModel(model_name)
         
-        # Prepare context - limit content to reduce token usage
-        all_documents = []
-        for doc in st.session_state.documents:
-            # Limit to first 500 characters per document to save tokens
-            content = doc['text'][:500]
-            all_documents.append(f"Document: {doc['name']}\nContent: {content}...")
+        # Send only the passages relevant to the question, not a slice of every document
+        if not relevant_content:
+            relevant_content = search_documents(question, top_k=ANSWER_CONTEXT_SENTENCES)
+        context = retrieval_context(relevant_content)
         
-        context = "\n\n".join(all_documents)
-        
-        # Shorter, more efficient prompt
-        prompt = f"""Answer this question based on the documents:
-
-Documents:
-{context}
-
-Question: {question}
-
-Answer briefly and cite the source document:"""
+        prompt = f"{ANSWER_INSTRUCTIONS}Documents:\n{context}\n\nQuestion: {question}"
         
         response = model.generate_content(prompt)
         return response.text.strip()
@@ -133,95 +395,158 @@ Answer briefly and cite the source document:"""
         if "quota" in str(e).lower() or "429" in str(e):
             return "AI quota exceeded. Here's what I found using smart search:"
         else:
+            list_generation_models.clear()  # the model list may be stale
             st.error(f"AI Error: {str(e)}")
             return "AI temporarily unavailable. Here's what I found using simple search:"
 
-def generate_ai_insights(question, relevant_content):
-    """Generate AI insights based on document content and question"""
+def stream_text(response):
+    """Text of a streamed Gemini response, piece by piece"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk without text parts, e.g. the final one
+        if text:
+            yield text
+
+def generate_ai_insights(question, relevant_content, stream=False):
+    """
+    Generate AI insights based on document content and question.
+    With stream=True, returns an iterator of text pieces as Gemini produces them.
+    """
     try:
-        models = genai.list_models()
-        available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
-        
-        if not available_models:
+        model_name = pick_model()
+        if model_name is None:
             return None
         
-        model_name = "gemini-2.0-flash-lite"
-        if model_name not in [m.split('/')[-1] for m in available_models]:
-            model_name = available_models[0].split('/')[-1]
-        
         model = genai.GenerativeModel(model_name)
         
-        # Prepare document context
-        doc_context = ""
-        if relevant_content:
-            doc_context = "Document excerpts:\n"
-            for result in relevant_content[:3]:  # Limit to top 3
-                doc_context += f"From {result['document']}: {result['text'][:200]}...\n"
+        prompt = f"{INSIGHTS_INSTRUCTIONS}{excerpt_context(relevant_content)}\nQuestion: {question}"
         
-        prompt = f"""Based on the following document content and question, provide additional insights and analysis:
-
-{doc_context}
-
-Question: {question}
-
-Provide:
-1. Additional context or background information
-2. Related concepts or implications
-3. Potential follow-up questions
-4. Key takeaways
-
-Keep it concise and relevant:"""
-        
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, stream=stream)
+        if stream:
+            return stream_text(response)
         return response.text.strip()
         
     except Exception as e:
         if "quota" in str(e).lower():
             return None
+        list_generation_models.clear()
         return None
 
-def generate_general_ai_answer(question):
-    """Generate general AI answer when no document content is found"""
+def excerpt_context(relevant_content):
+    """Prompt block with the top search excerpts for one question"""
+    doc_context = ""
+    if relevant_content:
+        doc_context = "Document excerpts:\n"
+        for result in relevant_content[:3]:  # Limit to top 3
+            doc_context += f"From {result['document']}: {result['text'][:200]}...\n"
+    return doc_context
+
+def generate_batch_insights(questions, relevant_contents):
+    """
+    Generate AI insights for several questions with a single Gemini call.
+    Returns one entry per question; None where the batch reply had no usable answer.
+    """
     try:
-        models = genai.list_models()
-        available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
+        model_name = pick_model()
+        if model_name is None:
+            return [None] * len(questions)
         
-        if not available_models:
-            return "AI not available"
+        model = genai.GenerativeModel(model_name)
         
-        model_name = "gemini-2.0-flash-lite"
-        if model_name not in [m.split('/')[-1] for m in available_models]:
-            model_name = available_models[0].split('/')[-1]
+        # The shared instructions are paid for once instead of once per question
+        blocks = []
+        for i, (question, relevant_content) in enumerate(zip(questions, relevant_contents), 1):
+            blocks.append(f"Question {i}: {question}\n{excerpt_context(relevant_content)}")
+        prompt = INSIGHTS_INSTRUCTIONS + BATCH_INSTRUCTIONS + "\n".join(blocks)
+        
+        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        insights = [None] * len(questions)
+        for item in json.loads(response.text):
+            number = item.get('q') if isinstance(item, dict) else None
+            if isinstance(number, int) and 1 <= number <= len(questions) and item.get('a'):
+                insights[number - 1] = str(item['a']).strip()
+        return insights
+        
+    except Exception as e:
+        if "quota" not in str(e).lower():
+            list_generation_models.clear()
+        return [None] * len(questions)
+
+def generate_general_ai_answer(question, stream=False):
+    """
+    Generate general AI answer when no document content is found.
+    With stream=True, returns an iterator of text pieces; errors are still returned as a message.
+    """
+    try:
+        model_name = pick_model()
+        if model_name is None:
+            return "AI not available"
         
         model = genai.GenerativeModel(model_name)
         
-        prompt = f"""Answer this question with general knowledge:
-
-Question: {question}
-
-Provide a helpful, accurate answer based on general knowledge. Keep it concise and informative:"""
+        prompt = f"{GENERAL_INSTRUCTIONS}Question: {question}"
         
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, stream=stream)
+        if stream:
+            return stream_text(response)
         return response.text.strip()
         
     except Exception as e:
         if "quota" in str(e).lower():
             return "AI quota exceeded - please try again later"
+        list_generation_models.clear()
         return "AI temporarily unavailable"
 
-def get_answer(question):
-    """Get comprehensive answer with both document content and AI insights"""
+def answer_cache_key(question):
+    """Normalized question plus the settings that change how it is answered"""
+    return (" ".join(question.lower().split()), st.session_state.ai_enabled, st.session_state.quota_mode)
+
+def cached_answer(question):
+    """Previously computed (answer, sources) for this question, or None"""
+    entry = st.session_state.answer_cache.get(answer_cache_key(question))
+    if entry and time.monotonic() - entry[0] < ANSWER_CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+def cache_answer(question, result):
+    """Remember an answer, evicting the oldest one when the cache is full"""
+    cache = st.session_state.answer_cache
+    if len(cache) >= ANSWER_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    cache[answer_cache_key(question)] = (time.monotonic(), result)
+
+def get_answer(question, relevant_content=None, ai_insights=None):
+    """
+    Get comprehensive answer with both document content and AI insights.
+    Returns (chunks, sources): the answer as an iterator of markdown pieces, streamed
+    while Gemini generates, and the document search results.
+    Search results and insights already produced by a batched call can be passed in.
+    """
     if not st.session_state.documents:
-        return "Please upload some documents first!", []
+        return iter(["Please upload some documents first!"]), []
+    
+    cached = cached_answer(question)
+    if cached is not None:
+        answer, sources = cached
+        return iter([answer]), sources
     
     # Always search documents first
-    relevant_content = search_documents(question)
+    if relevant_content is None:
+        relevant_content = search_documents(question)
     
-    # Build comprehensive answer
-    answer_parts = []
+    return answer_chunks(question, relevant_content, ai_insights), relevant_content
+
+def answer_chunks(question, relevant_content, ai_insights):
+    """Yield the answer markdown piece by piece; the full answer is cached once it completes"""
+    pieces = []
+    ai_failed = False  # failed AI answers are not cached, so a repeat question retries
+    ai_mode = st.session_state.ai_enabled and not st.session_state.quota_mode
     
     # Part 1: Exact answers from documents
     if relevant_content:
+        answer_parts = []
         answer_parts.append("📄 **EXACT ANSWERS FROM YOUR DOCUMENTS:**")
         answer_parts.append("")
         for i, result in enumerate(relevant_content, 1):
@@ -230,47 +555,70 @@ def get_answer(question):
             answer_parts.append("")
         answer_parts.append("---")
         answer_parts.append("")
+        pieces.append("\n".join(answer_parts) + "\n")
+        yield pieces[-1]
     
-    # Part 2: AI-generated relevant insights (if enabled and not in quota mode)
-    if st.session_state.ai_enabled and not st.session_state.quota_mode:
+    # Part 2: AI-generated relevant insights (if enabled and not in quota mode);
+    # without document content there is nothing to analyze and Part 3 answers instead
+    if ai_mode and relevant_content:
+        produced = len(pieces)
         try:
-            ai_insights = generate_ai_insights(question, relevant_content)
-            if ai_insights:
-                answer_parts.append("🤖 **AI-GENERATED INSIGHTS:**")
-                answer_parts.append("")
-                answer_parts.append(ai_insights)
-                answer_parts.append("")
-                answer_parts.append("💡 *This AI analysis is based on your documents and general knowledge*")
+            if ai_insights is None:
+                ai_insights = generate_ai_insights(question, relevant_content, stream=True)
+            for piece in ai_section("🤖 **AI-GENERATED INSIGHTS:**", ai_insights,
+                                    "💡 *This AI analysis is based on your documents and general knowledge*"):
+                pieces.append(piece)
+                yield piece
         except Exception as e:
             if "quota" not in str(e).lower():
                 st.error(f"AI Error: {str(e)}")
+        ai_failed = len(pieces) == produced
     
     # Part 3: Fallback if no document content found
     if not relevant_content:
-        if st.session_state.ai_enabled and not st.session_state.quota_mode:
+        suggestions = []
+        if ai_mode:
             try:
-                ai_general = generate_general_ai_answer(question)
-                answer_parts.append("🤖 **AI GENERAL KNOWLEDGE:**")
-                answer_parts.append("")
-                answer_parts.append(ai_general)
-                answer_parts.append("")
-                answer_parts.append("⚠️ *This information is not from your documents but from general AI knowledge*")
+                ai_general = generate_general_ai_answer(question, stream=True)
+                ai_failed = ai_failed or isinstance(ai_general, str)  # an error message
+                for piece in ai_section("🤖 **AI GENERAL KNOWLEDGE:**", ai_general,
+                                        "⚠️ *This information is not from your documents but from general AI knowledge*"):
+                    pieces.append(piece)
+                    yield piece
             except Exception as e:
-                answer_parts.append("❌ **No relevant information found in your documents.**")
-                answer_parts.append("")
-                answer_parts.append("💡 **Suggestions:**")
-                answer_parts.append("• Try rephrasing your question")
-                answer_parts.append("• Upload more relevant documents")
-                answer_parts.append("• Use different keywords")
+                ai_failed = True
+                suggestions.append("❌ **No relevant information found in your documents.**")
+                suggestions.append("")
+                suggestions.append("💡 **Suggestions:**")
+                suggestions.append("• Try rephrasing your question")
+                suggestions.append("• Upload more relevant documents")
+                suggestions.append("• Use different keywords")
         else:
-            answer_parts.append("❌ **No relevant information found in your documents.**")
-            answer_parts.append("")
-            answer_parts.append("💡 **Suggestions:**")
-            answer_parts.append("• Try rephrasing your question")
-            answer_parts.append("• Upload more relevant documents")
-            answer_parts.append("• Enable AI mode for general knowledge insights")
+            suggestions.append("❌ **No relevant information found in your documents.**")
+            suggestions.append("")
+            suggestions.append("💡 **Suggestions:**")
+            suggestions.append("• Try rephrasing your question")
+            suggestions.append("• Upload more relevant documents")
+            suggestions.append("• Enable AI mode for general knowledge insights")
+        if suggestions:
+            pieces.append("\n" + "\n".join(suggestions))
+            yield pieces[-1]
     
-    return "\n".join(answer_parts), relevant_content
+    if not ai_failed:
+        cache_answer(question, ("".join(pieces), relevant_content))
+
+def ai_section(title, text, footer):
+    """
+    Yield an AI answer section as markdown pieces.
+    text is a string or an iterator of streamed pieces; nothing is yielded when it is empty.
+    """
+    text_pieces = iter([text]) if isinstance(text, str) else iter(text or ())
+    first = next(filter(None, text_pieces), None)
+    if first is None:
+        return
+    yield f"{title}\n\n{first}"
+    yield from text_pieces
+    yield f"\n\n{footer}\n"
 
 # Voice Chat Functions
 @st.cache_resource
@@ -322,18 +670,36 @@ def listen_to_voice():
             st.error(f"Voice recognition error: {str(e)}")
             return None
 
+def clean_for_speech(text):
+    """Remove markdown formatting so the answer reads naturally"""
+    text = SPEECH_MARKDOWN.sub(lambda match: match.group(1) or '', text)
+    # Removed separators can leave adjacent newline runs, so these go last
+    return SPEECH_NEWLINES.sub('. ', text)
+
+@st.cache_resource
+def get_speech_queue(_engine):
+    """Utterance queue drained by one persistent text-to-speech thread"""
+    utterances = queue.Queue()
+    threading.Thread(target=speech_worker, args=(_engine, utterances), daemon=True).start()
+    return utterances
+
+def speech_worker(engine, utterances):
+    """Speak queued texts one at a time, so the shared engine is never driven concurrently"""
+    while True:
+        text = utterances.get()
+        try:
+            engine.say(text)
+            engine.runAndWait()
+        except Exception:
+            pass  # keep serving later requests
+
 def speak_text(text):
     """Convert text to speech"""
     engine = get_text_to_speech()
     if engine:
         try:
-            # Run text-to-speech in a separate thread to avoid blocking
-            def speak():
-                engine.say(text)
-                engine.runAndWait()
-            
-            thread = threading.Thread(target=speak)
-            thread.start()
+            # Playback happens on the speech thread to avoid blocking
+            get_speech_queue(engine).put(text)
             return True
         except Exception as e:
             st.error(f"Text-to-speech error: {str(e)}")
@@ -344,6 +710,12 @@ def speak_text(text):
 
 
 
+# Restore the documents this session uploaded in earlier runs
+if not st.session_state.corpus_loaded:
+    st.session_state.documents = load_corpus()
+    st.session_state.corpus_loaded = True
+    rebuild_index()
+
 # Main Interface
 st.title("🤖 Enhanced QA Agent")
 st.markdown("Upload documents and get intelligent answers!")
@@ -354,10 +726,8 @@ with col1:
     if st.session_state.ai_enabled:
         # Test AI connection
         try:
-            # List available models first
-            models = genai.list_models()
-            available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
-            
+            # List available models first; cached after the first run
+            pick_model()
         except Exception as e:
             if "quota" in str(e).lower() or "429" in str(e):
                 pass
@@ -386,18 +756,25 @@ uploaded_files = st.sidebar.file_uploader(
 
 # Process uploads
 if uploaded_files:
+    existing = {d['name'] for d in st.session_state.documents}
+    new_files = []
     for file in uploaded_files:
-        if file.name not in [d['name'] for d in st.session_state.documents]:
-            with st.spinner(f"Processing {file.name}..."):
-                text = extract_text(file)
-                doc = {
-                    'name': file.name,
-                    'text': text,
-                    'word_count': len(text.split()),
-                    'uploaded_at': datetime.now().strftime("%H:%M:%S")
-                }
-                st.session_state.documents.append(doc)
-                st.sidebar.success(f"✅ Added {file.name}")
+        if file.name not in existing:
+            existing.add(file.name)
+            new_files.append(file)
+    
+    if new_files:
+        # Parsers spend most of their time in C code, so threads overlap the files;
+        # Streamlit calls stay on this thread
+        with st.spinner(f"Processing {len(new_files)} file(s)..."):
+            with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(new_files))) as executor:
+                extracted = list(executor.map(load_or_extract, new_files))
+        
+        for file, (text, content_hash) in zip(new_files, extracted):
+            st.session_state.documents.append(make_document(file.name, text, content_hash))
+            st.sidebar.success(f"✅ Added {file.name}")
+        save_manifest(st.session_state.documents)
+        rebuild_index()
 
 # Show documents
 st.sidebar.header("📚 Documents")
@@ -408,6 +785,10 @@ if st.session_state.documents:
             st.write(f"**Time:** {doc['uploaded_at']}")
             if st.button("🗑️ Remove", key=f"rm_{i}"):
                 st.session_state.documents.pop(i)
+                # Only this session's manifest changes: the cached text may be shared
+                # with other sessions and is left to age out
+                save_manifest(st.session_state.documents)
+                rebuild_index()
                 st.rerun()
 else:
     st.sidebar.info("No documents yet")
@@ -438,7 +819,7 @@ with col1:
         with st.spinner("Preparing voice input..."):
             voice_text = listen_to_voice()
             if voice_text:
-                st.session_state.voice_question = voice_text
+                st.session_state.pending_questions.append(voice_text)
                 st.success(f"🎤 Heard: '{voice_text}'")
 
 with col2:
@@ -446,12 +827,7 @@ with col2:
         if st.session_state.chat_history:
             last_answer = st.session_state.chat_history[-1].get('answer', '')
             if last_answer:
-                # Clean the answer for speech (remove markdown formatting)
-                clean_answer = re.sub(r'\*\*(.*?)\*\*', r'\1', last_answer)  # Remove bold
-                clean_answer = re.sub(r'#{1,6}\s*', '', clean_answer)  # Remove headers
-                clean_answer = re.sub(r'---+', '', clean_answer)  # Remove separators
-                clean_answer = re.sub(r'\n+', '. ', clean_answer)  # Replace newlines with periods
-                clean_answer = clean_answer[:500]  # Limit length for speech
+                clean_answer = clean_for_speech(last_answer)[:500]  # Limit length for speech
                 
                 if speak_text(clean_answer):
                     st.success("🔊 Reading answer...")
@@ -467,22 +843,36 @@ with col3:
     st.markdown("• Click 'Voice Input' to speak your question")
     st.markdown("• Click 'Read Answer' to hear the response")
 
-# Display voice question if available
-if 'voice_question' in st.session_state and st.session_state.voice_question:
-    st.info(f"🎤 **Voice Input:** {st.session_state.voice_question}")
-    if st.button("Use This Question"):
-        question = st.session_state.voice_question
-        del st.session_state.voice_question
-    else:
-        question = None
-else:
-    question = None
+# Display queued voice questions; several are answered together
+questions = []
+if st.session_state.pending_questions:
+    st.info("🎤 **Voice Input:** " + " | ".join(st.session_state.pending_questions))
+    if st.button("Use This Question" if len(st.session_state.pending_questions) == 1 else "Use These Questions"):
+        questions = st.session_state.pending_questions
+        st.session_state.pending_questions = []
 
 # Chat input
-if not question:
+if not questions:
     question = st.chat_input("Ask a question about your documents...")
-
-if question:
+    if question:
+        questions = [question]
+
+# Two or more questions share one Gemini call for their insights
+searches = [None] * len(questions)
+batch_insights = [None] * len(questions)
+uncached = [i for i, q in enumerate(questions) if cached_answer(q) is None]
+if len(uncached) >= 2 and st.session_state.documents and st.session_state.ai_enabled and not st.session_state.quota_mode:
+    for i in uncached:
+        searches[i] = search_documents(questions[i])
+    # Questions without document hits get a general-knowledge answer, not insights
+    grounded = [i for i in uncached if searches[i]]
+    if len(grounded) >= 2:
+        with st.spinner("🤔 Generating insights for all questions..."):
+            insights = generate_batch_insights([questions[i] for i in grounded], [searches[i] for i in grounded])
+        for i, text in zip(grounded, insights):
+            batch_insights[i] = text
+
+for question, relevant_content, ai_insights in zip(questions, searches, batch_insights):
     # Add to history
     st.session_state.chat_history.append({
         'question': question,
@@ -497,10 +887,10 @@ if question:
     # Get answer
     with st.chat_message("assistant"):
         with st.spinner("🤔 Analyzing documents and generating insights..." if st.session_state.ai_enabled else "🔍 Searching documents..."):
-            answer, sources = get_answer(question)
+            chunks, sources = get_answer(question, relevant_content, ai_insights)
             
-            # Display the comprehensive answer with proper formatting
-            st.markdown(answer)
+            # Display the comprehensive answer as it streams in
+            answer = st.write_stream(chunks)
             
             # Update history
             st.session_state.chat_history[-1].update({
@@ -513,7 +903,7 @@ if question:
                 with st.expander("📚 Document Sources"):
                     for i, source in enumerate(sources, 1):
                         st.write(f"**{i}. {source['document']}**")
-                        st.write(f"*Relevance: {source['relevance']} matches*")
+                        st.write(f"*Relevance score: {source['relevance']}*")
                         st.write(source['text'])
                         st.write("---")
 
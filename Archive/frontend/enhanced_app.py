@@ -4,12 +4,32 @@ Supports images, voice, Google Drive, and mobile
 """
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import io
+import os
+import sqlite3
+import threading
+import uuid
 import base64
 from datetime import datetime
 import time
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+    REQUESTS_TOOLBELT_AVAILABLE = True
+except ImportError:
+    REQUESTS_TOOLBELT_AVAILABLE = False
+    MultipartEncoder = None
+
 # Configure page
 st.set_page_config(
     page_title="🤖 Enhanced QA Agent",
@@ -22,18 +42,31 @@ st.set_page_config(
 API_BASE = "http://localhost:5000/api"
 FALLBACK_API_BASE = "http://127.0.0.1:5000/api"
 
-def get_api_base():
-    """Get working API base URL"""
-    import requests
+# Seconds a working API base URL is reused before the health probe runs again
+API_BASE_TTL = 30
+
+@st.cache_resource
+def get_http_session():
+    """Keep-alive HTTP session shared by all backend calls and reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                          max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+@st.cache_resource(ttl=API_BASE_TTL)
+def _probe_api_base():
+    """Probe the health endpoints for a working API base URL; shared by all sessions"""
     try:
-        response = requests.get(f"{API_BASE}/health", timeout=2)
+        response = get_http_session().get(f"{API_BASE}/health", timeout=2)
         if response.status_code == 200:
             return API_BASE
     except:
         pass
     
     try:
-        response = requests.get(f"{FALLBACK_API_BASE}/health", timeout=2)
+        response = get_http_session().get(f"{FALLBACK_API_BASE}/health", timeout=2)
         if response.status_code == 200:
             return FALLBACK_API_BASE
     except:
@@ -41,6 +74,13 @@ def get_api_base():
     
     return None
 
+def get_api_base():
+    """Get working API base URL"""
+    api_base = _probe_api_base()
+    if api_base is None:
+        _probe_api_base.clear()  # don't remember an outage; probe again next time
+    return api_base
+
 # Custom CSS for mobile support
 st.markdown("""
 <style>
@@ -70,40 +110,66 @@ st.markdown("""
 
 def init_session_state():
     """Initialize session state"""
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
     if 'documents' not in st.session_state:
         st.session_state.documents = []
+    if 'backend_ok' not in st.session_state:
+        st.session_state.backend_ok = True  # updated after every backend call
     if 'voice_enabled' not in st.session_state:
         st.session_state.voice_enabled = False
 
-def make_api_request(endpoint, method='GET', data=None, files=None):
-    """Make API request with proper error handling"""
+def send_request(url, method, data=None, files=None):
+    """Send one HTTP request to the backend"""
+    session = get_http_session()
+    headers = {'Content-Type': 'application/json'} if data and not files else {}
+    
+    if method == 'GET':
+        return session.get(url, headers=headers, timeout=10)
+    elif method == 'POST':
+        if files:
+            # File objects are read from the start on every attempt, including retries
+            for _, fileobj, *_ in files.values():
+                fileobj.seek(0)
+            if REQUESTS_TOOLBELT_AVAILABLE:
+                # Stream the multipart body from the file instead of building it in memory
+                body = MultipartEncoder(fields={**(data or {}), **files})
+                return session.post(url, data=body, headers={'Content-Type': body.content_type}, timeout=30)
+            return session.post(url, data=data, files=files, timeout=30)
+        if ORJSON_AVAILABLE and data is not None:
+            return session.post(url, data=orjson.dumps(data), headers={'Content-Type': 'application/json'}, timeout=10)
+        return session.post(url, json=data, headers=headers, timeout=10)
+    elif method == 'DELETE':
+        return session.delete(url, headers=headers, timeout=10)
+
+def _api_request(endpoint, method='GET', data=None, files=None):
+    """
+    Make API request with proper error handling; touches no session state,
+    so cached functions can call it ('connected' is False when unreachable)
+    """
     api_base = get_api_base()
     if not api_base:
         return {
             'success': False, 
+            'connected': False,
             'error': 'Backend API not available. Please start the backend server.',
             'message': 'Run: python backend/enhanced_api.py'
         }
     
     try:
-        url = f"{api_base}{endpoint}"
-        headers = {'Content-Type': 'application/json'} if data and not files else {}
-        
-        if method == 'GET':
-            response = requests.get(url, headers=headers, timeout=10)
-        elif method == 'POST':
-            if files:
-                response = requests.post(url, data=data, files=files, timeout=30)
-            else:
-                response = requests.post(url, json=data, headers=headers, timeout=10)
-        elif method == 'DELETE':
-            response = requests.delete(url, headers=headers, timeout=10)
+        try:
+            response = send_request(f"{api_base}{endpoint}", method, data, files)
+        except requests.exceptions.ConnectionError:
+            # The cached base URL may have gone away; probe again and retry once
+            _probe_api_base.clear()
+            api_base = get_api_base()
+            if not api_base:
+                raise
+            response = send_request(f"{api_base}{endpoint}", method, data, files)
         
-        # Handle response
-        if response.status_code == 200:
-            return response.json() if response.headers.get('content-type', '').startswith('application/json') else {'success': True, 'data': response.text}
+        # Handle response (uploads are accepted with 202 and processed in the background)
+        if response.status_code in (200, 202):
+            if response.headers.get('content-type', '').startswith('application/json'):
+                return orjson.loads(response.content) if ORJSON_AVAILABLE else response.json()
+            return {'success': True, 'data': response.text}
         else:
             return {
                 'success': False, 
@@ -114,10 +180,12 @@ def make_api_request(endpoint, method='GET', data=None, files=None):
     except requests.exceptions.ConnectionError:
         return {
             'success': False, 
+            'connected': False,
             'error': 'Connection failed',
             'message': 'Cannot connect to backend API. Please ensure the backend server is running.'
         }
     except requests.exceptions.Timeout:
+        _probe_api_base.clear()
         return {
             'success': False, 
             'error': 'Request timeout',
@@ -130,24 +198,133 @@ def make_api_request(endpoint, method='GET', data=None, files=None):
             'message': f'Unexpected error: {str(e)}'
         }
 
+def record_backend_status(result):
+    """Update the connection banner state from a backend call's result"""
+    st.session_state.backend_ok = result.get('connected', True)
+    return result
+
+def make_api_request(endpoint, method='GET', data=None, files=None):
+    """Make API request and record whether the backend was reachable"""
+    return record_backend_status(_api_request(endpoint, method, data, files))
+
+# Seconds the sidebar/documents snapshot is reused across reruns
+DASHBOARD_TTL = 5
+
+@st.cache_data(ttl=DASHBOARD_TTL, show_spinner=False)
+def _fetch_dashboard():
+    """Stats, capabilities and documents from one backend round trip"""
+    return _api_request('/dashboard')
+
+def get_dashboard():
+    """Current dashboard snapshot; failures are not cached"""
+    dashboard = record_backend_status(_fetch_dashboard())
+    if not dashboard.get('success'):
+        _fetch_dashboard.clear()
+    return dashboard
+
+# Answer caching for /ask: exact repeats skip the backend LLM call
+ASK_CACHE_TTL = 600
+ASK_CACHE_SIZE = 200
+
+class AskFailed(Exception):
+    """Raised from the cached /ask call so failed answers are not cached"""
+    def __init__(self, result):
+        super().__init__(result.get('error'))
+        self.result = result
+
+@st.cache_data(ttl=ASK_CACHE_TTL, max_entries=ASK_CACHE_SIZE, show_spinner=False)
+def _ask_cached(question_key, voice_response, _question):
+    """/ask result for a normalized question; _question is the text as typed (not hashed)"""
+    result = _api_request('/ask', 'POST', data={
+        'question': _question,
+        'include_voice_response': voice_response
+    })
+    if not result.get('success'):
+        raise AskFailed(result)
+    return result
+
+def ask_backend(question, voice_response):
+    """Answer a question, serving exact repeats from cache"""
+    try:
+        result = _ask_cached(" ".join(question.lower().split()), voice_response, question)
+    except AskFailed as e:
+        result = e.result
+    return record_backend_status(result)
+
+# Chat history lives in sqlite so reruns don't carry it in session state and tabs share it
+CHAT_DB_PATH = os.path.join(".cache", "session.db")
+CHAT_HISTORY_LIMIT = 50
+
+@st.cache_resource
+def get_chat_db():
+    """Shared sqlite connection for chat history, with the lock that serializes its use"""
+    os.makedirs(os.path.dirname(CHAT_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(CHAT_DB_PATH, check_same_thread=False)
+    conn.execute('CREATE TABLE IF NOT EXISTS chat (session_id TEXT, ts TEXT, question TEXT, answer TEXT, sources_json TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS chat_session ON chat (session_id, ts)')
+    conn.commit()
+    return conn, threading.Lock()
+
+def chat_session_id():
+    """
+    History is shared by every tab opened with the same ?session= value;
+    a visit without one gets a fresh random ID written back to the URL
+    """
+    session_id = st.query_params.get('session')
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params['session'] = session_id
+    return session_id
+
+def load_chat_history(session_id):
+    """Most recent chat turns of a session, oldest first"""
+    conn, lock = get_chat_db()
+    with lock:
+        rows = conn.execute(
+            'SELECT question, answer, sources_json FROM chat WHERE session_id = ? ORDER BY ts DESC, rowid DESC LIMIT ?',
+            (session_id, CHAT_HISTORY_LIMIT)
+        ).fetchall()
+    return [{'question': q, 'answer': a, 'sources': json.loads(sources)} for q, a, sources in reversed(rows)]
+
+def save_chat(session_id, question, answer, sources):
+    """Append one answered question to a session's history"""
+    conn, lock = get_chat_db()
+    with lock:
+        conn.execute(
+            'INSERT INTO chat (session_id, ts, question, answer, sources_json) VALUES (?, ?, ?, ?, ?)',
+            (session_id, datetime.now().isoformat(), question, answer, json.dumps(sources))
+        )
+        conn.commit()
+
+def invalidate_caches():
+    """Drop cached backend data after the document set changes"""
+    _fetch_dashboard.clear()
+    _ask_cached.clear()
+
 def display_header():
-    """Display header with connection status"""
+    """Display header; returns the slot for the connection banner"""
     st.markdown('<h1 class="main-header">🤖 Enhanced QA Agent</h1>', unsafe_allow_html=True)
     st.markdown('<p class="mobile-friendly">Upload documents, images, voice notes, or connect Google Drive</p>', unsafe_allow_html=True)
-    
-    # Show connection status
-    api_base = get_api_base()
-    if api_base:
-        st.success(f"✅ Connected to backend at {api_base}")
-    else:
-        st.error("❌ Backend not connected. Please start the backend server.")
-        st.info("To start backend: `python backend/enhanced_api.py`")
-        st.stop()
+    return st.empty()
+
+def show_backend_status(slot):
+    """Warn in the header slot when a backend call in this run could not connect"""
+    if not st.session_state.backend_ok:
+        with slot.container():
+            st.error("❌ Backend not connected. Please start the backend server.")
+            st.info("To start backend: `python backend/enhanced_api.py`")
+
+# Upload size limit used when the backend does not report its own
+DEFAULT_MAX_FILE_SIZE_MB = 50
 
-def sidebar_upload():
+def sidebar_upload(result):
     """File upload sidebar"""
     st.sidebar.header("📁 Upload Files")
     
+    max_size_mb = DEFAULT_MAX_FILE_SIZE_MB
+    if result.get('success'):
+        max_size_mb = result.get('capabilities', {}).get('max_file_size_mb', max_size_mb)
+    
     # File uploader
     uploaded_files = st.sidebar.file_uploader(
         "Choose files",
@@ -160,6 +337,10 @@ def sidebar_upload():
     
     if uploaded_files:
         for uploaded_file in uploaded_files:
+            # Oversized files are never read or sent; the backend would reject them anyway
+            if uploaded_file.size > max_size_mb * 1024 * 1024:
+                st.sidebar.warning(f"⚠️ {uploaded_file.name} is {uploaded_file.size / (1024 * 1024):.1f} MB, over the {max_size_mb} MB limit")
+                continue
             if st.sidebar.button(f"Add {uploaded_file.name}", key=f"add_{uploaded_file.name}"):
                 add_document(uploaded_file)
     
@@ -171,10 +352,11 @@ def sidebar_upload():
 def add_document(uploaded_file):
     """Add document to knowledge base"""
     with st.spinner(f"Adding {uploaded_file.name}..."):
-        files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+        files = {'file': (uploaded_file.name, uploaded_file, uploaded_file.type)}
         result = make_api_request('/documents', 'POST', files=files)
         
         if result.get('success'):
+            invalidate_caches()
             st.sidebar.success(f"✅ Added {uploaded_file.name}")
             st.rerun()
         else:
@@ -205,16 +387,23 @@ def add_drive_file(file_id):
     with st.spinner("Adding Drive file..."):
         result = make_api_request(f'/google-drive/download/{file_id}')
         if result.get('success'):
+            invalidate_caches()
             st.sidebar.success("✅ Added Drive file")
         else:
             st.sidebar.error("❌ Failed to add Drive file")
 
+# Chat interactions rerun only the chat section where Streamlit supports fragments
+chat_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+@chat_fragment
 def chat_interface():
     """Main chat interface"""
     st.header("💬 Chat with Your Documents")
     
+    session_id = chat_session_id()
+    
     # Display chat history
-    for i, chat in enumerate(st.session_state.chat_history):
+    for chat in load_chat_history(session_id):
         with st.chat_message("user"):
             st.write(chat['question'])
         
@@ -233,13 +422,6 @@ def chat_interface():
         voice_response = st.checkbox("🎤 Voice Response", help="Include voice response")
     
     if question:
-        # Add to chat history
-        st.session_state.chat_history.append({
-            'question': question,
-            'answer': '',
-            'sources': []
-        })
-        
         # Display user message
         with st.chat_message("user"):
             st.write(question)
@@ -247,21 +429,14 @@ def chat_interface():
         # Get answer
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                data = {
-                    'question': question,
-                    'include_voice_response': voice_response
-                }
-                result = make_api_request('/ask', 'POST', data=data)
+                result = ask_backend(question, voice_response)
                 
                 if result.get('success'):
                     answer = result.get('answer', '')
                     st.write(answer)
                     
-                    # Update chat history
-                    st.session_state.chat_history[-1].update({
-                        'answer': answer,
-                        'sources': result.get('sources', [])
-                    })
+                    # Add to chat history
+                    save_chat(session_id, question, answer, result.get('sources', []))
                     
                     # Show sources
                     if result.get('sources'):
@@ -272,12 +447,10 @@ def chat_interface():
                 else:
                     st.error(f"❌ {result.get('error', 'Failed to get answer')}")
 
-def documents_section():
+def documents_section(result):
     """Documents management section"""
     st.header("📚 Your Documents")
     
-    # Get documents
-    result = make_api_request('/documents')
     if result.get('success'):
         documents = result.get('documents', [])
         
@@ -301,16 +474,16 @@ def remove_document(doc_id):
     """Remove document"""
     result = make_api_request(f'/documents/{doc_id}', 'DELETE')
     if result.get('success'):
+        invalidate_caches()
         st.success("✅ Document removed")
         st.rerun()
     else:
         st.error("❌ Failed to remove document")
 
-def stats_section():
+def stats_section(result):
     """Statistics section"""
     st.sidebar.header("📊 Statistics")
     
-    result = make_api_request('/stats')
     if result.get('success'):
         stats = result.get('stats', {})
         
@@ -322,11 +495,10 @@ def stats_section():
             st.metric("Words", f"{stats.get('total_words', 0):,}")
             st.metric("Size (MB)", stats.get('total_size_mb', 0))
 
-def capabilities_section():
+def capabilities_section(result):
     """System capabilities section"""
     st.sidebar.header("🔧 Capabilities")
     
-    result = make_api_request('/capabilities')
     if result.get('success'):
         caps = result.get('capabilities', {})
         
@@ -339,13 +511,17 @@ def capabilities_section():
 def main():
     """Main application"""
     init_session_state()
-    display_header()
+    # No health probe here: the banner reflects the backend calls this run makes
+    status_slot = display_header()
+    
+    # One backend round trip feeds the statistics, capabilities and documents views
+    dashboard = get_dashboard()
     
     # Sidebar
-    sidebar_upload()
+    sidebar_upload(dashboard)
     google_drive_section()
-    stats_section()
-    capabilities_section()
+    stats_section(dashboard)
+    capabilities_section(dashboard)
     
     # Main content
     tab1, tab2 = st.tabs(["💬 Chat", "📚 Documents"])
@@ -354,7 +530,9 @@ def main():
         chat_interface()
     
     with tab2:
-        documents_section()
+        documents_section(dashboard)
+    
+    show_backend_status(status_slot)
     
     # Footer
     st.markdown("---")
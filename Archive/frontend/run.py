@@ -2,20 +2,18 @@
 """
 Frontend runner for Smart Document QA Agent
 """
-import subprocess
-import sys
-import os
+from streamlit.web import bootstrap
 
 def main():
-    """Run the Streamlit frontend application"""
-    # Set environment variables
-    os.environ['STREAMLIT_BROWSER_GATHER_USAGE_STATS'] = 'false'
+    """Run the Streamlit frontend application in this interpreter"""
+    flag_options = {
+        'server.headless': True,
+        'browser.gatherUsageStats': False
+    }
     
     # Run streamlit
-    subprocess.run([
-        sys.executable, '-m', 'streamlit', 'run', 'app.py',
-        '--server.headless', 'true'
-    ])
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run('app.py', False, [], flag_options)
 
 if __name__ == "__main__":
     main()
@@ -4,11 +4,24 @@ For testing and demonstration purposes
 """
 import streamlit as st
 import os
-import tempfile
-import PyPDF2
-import docx
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import json
+import numpy as np
+from text_extraction import extract_text_from_file
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from scipy import sparse
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+    TfidfVectorizer = None
+    sparse = None
 
 # Configure page
 st.set_page_config(
@@ -17,81 +30,215 @@ st.set_page_config(
     layout="wide"
 )
 
-def extract_text_from_file(file):
-    """Extract text from uploaded file"""
-    try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        # Extract text based on file type
-        file_ext = os.path.splitext(file.name)[1].lower()
-        
-        if file_ext == '.pdf':
-            text = extract_pdf_text(tmp_file_path)
-        elif file_ext == '.txt':
-            with open(tmp_file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-        elif file_ext in ['.docx', '.doc']:
-            text = extract_docx_text(tmp_file_path)
-        else:
-            text = "Unsupported file type"
-        
-        # Clean up
-        os.unlink(tmp_file_path)
-        return text
-        
-    except Exception as e:
-        return f"Error processing file: {str(e)}"
+# Extracted text shared across sessions and reruns, keyed by SHA-256 of the file bytes
+EXTRACTED_TEXT_CACHE_SIZE = 64
+HASH_CHUNK_SIZE = 1 << 20
 
-def extract_pdf_text(file_path):
-    """Extract text from PDF"""
-    try:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        return f"PDF extraction error: {str(e)}"
-
-def extract_docx_text(file_path):
-    """Extract text from DOCX"""
-    try:
-        doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        return f"DOCX extraction error: {str(e)}"
-
-def simple_search(text, query):
+# Search indexes persisted across restarts, keyed by the document set and vectorizer settings
+INDEX_CACHE_DIR = ".cache"
+INDEX_CACHE_MAX_AGE_DAYS = 30
+INDEX_CACHE_MAX_ENTRIES = 32
+TFIDF_NGRAM_RANGE = (1, 2)
+TFIDF_INDEX_ID = f"tfidf-{TFIDF_NGRAM_RANGE[0]}-{TFIDF_NGRAM_RANGE[1]}"
+
+@st.cache_resource
+def get_extraction_pool():
+    """Worker processes for CPU-bound PDF/DOCX parsing"""
+    return ProcessPoolExecutor(max_workers=os.cpu_count())
+
+@st.cache_resource
+def get_text_cache():
+    """Least-recently-used map of content hash to extracted text, with its lock"""
+    return OrderedDict(), threading.Lock()
+
+def upload_hash(uploaded_file):
+    """SHA-256 of an uploaded file's bytes, computed once per upload"""
+    hashes = st.session_state.upload_hashes
+    if uploaded_file.file_id not in hashes:
+        # Hash in chunks rather than copying the whole file out with getvalue()
+        digest = hashlib.sha256()
+        uploaded_file.seek(0)
+        for chunk in iter(lambda: uploaded_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        uploaded_file.seek(0)
+        hashes[uploaded_file.file_id] = digest.hexdigest()
+    return hashes[uploaded_file.file_id]
+
+def extract_texts(files, hashes):
+    """Extract text from uploaded files in parallel, reusing text already extracted"""
+    cache, lock = get_text_cache()
+    texts = {}
+    pending = {}
+    with lock:
+        for file, content_hash in zip(files, hashes):
+            if content_hash in cache:
+                cache.move_to_end(content_hash)
+                texts[content_hash] = cache[content_hash]
+    
+    pool = get_extraction_pool()
+    for file, content_hash in zip(files, hashes):
+        if content_hash not in texts and content_hash not in pending.values():
+            pending[pool.submit(extract_text_from_file, file.name, file.getvalue())] = content_hash
+    
+    for future in as_completed(pending):
+        content_hash = pending[future]
+        texts[content_hash] = future.result()
+        with lock:
+            cache[content_hash] = texts[content_hash]
+            if len(cache) > EXTRACTED_TEXT_CACHE_SIZE:
+                cache.popitem(last=False)
+    
+    return [texts[content_hash] for content_hash in hashes]
+
+def split_sentences(text):
+    """Sentences of a document and their lowercase forms, computed once when it is added"""
+    sentences = text.split('.')
+    return sentences, [sentence.lower() for sentence in sentences]
+
+def simple_search(doc, query):
     """Simple text search"""
-    if not text or not query:
+    if not doc['text'] or not query:
         return []
     
-    text_lower = text.lower()
     query_lower = query.lower()
-    
-    # Split text into sentences
-    sentences = text.split('.')
     results = []
     
-    for i, sentence in enumerate(sentences):
-        if query_lower in sentence.lower():
+    for i, sentence_lower in enumerate(doc['sentences_lower']):
+        if query_lower in sentence_lower:
             results.append({
-                'sentence': sentence.strip(),
+                'sentence': doc['sentences'][i].strip(),
                 'position': i,
-                'relevance': sentence.lower().count(query_lower)
+                'relevance': sentence_lower.count(query_lower)
             })
     
     # Sort by relevance
     results.sort(key=lambda x: x['relevance'], reverse=True)
     return results[:5]  # Top 5 results
 
+def index_path(doc_keys):
+    """Cache file stem for the index of a document set"""
+    key = hashlib.sha256(json.dumps([TFIDF_INDEX_ID, sorted(doc_keys)]).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_CACHE_DIR, f"index_{key}")
+
+def load_tfidf_index(path):
+    """Index saved by an earlier process, or None if it is missing or unreadable"""
+    try:
+        with open(f"{path}.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        matrix = sparse.load_npz(f"{path}.npz")
+        vectorizer = TfidfVectorizer(ngram_range=TFIDF_NGRAM_RANGE, lowercase=True, vocabulary=meta['vocabulary'])
+        vectorizer.idf_ = np.asarray(meta['idf'])
+        refs = [tuple(ref) for ref in meta['refs']]
+    except (OSError, ValueError, KeyError):
+        return None
+    if matrix.shape != (len(refs), len(meta['vocabulary'])):
+        return None
+    try:
+        os.utime(f"{path}.json")  # recently used indexes are kept
+    except OSError:
+        pass
+    return vectorizer, matrix, refs
+
+def prune_tfidf_indexes():
+    """Delete saved indexes unused for too long, then the least recently used beyond the entry limit"""
+    cutoff = time.time() - INDEX_CACHE_MAX_AGE_DAYS * 86400
+    try:
+        # An index is live once its metadata file exists; that file's mtime is its last use
+        entries = [entry for entry in os.scandir(INDEX_CACHE_DIR)
+                   if entry.name.startswith('index_') and entry.name.endswith('.json') and '.tmp' not in entry.name]
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for rank, entry in enumerate(entries):
+        try:
+            if rank < INDEX_CACHE_MAX_ENTRIES and entry.stat().st_mtime >= cutoff:
+                continue
+            stem = entry.path[:-len('.json')]
+            os.remove(entry.path)  # metadata first, so a half-deleted index is never loaded
+            os.remove(f"{stem}.npz")
+        except OSError:
+            continue
+
+def save_tfidf_index(path, vectorizer, matrix, refs):
+    """Write an index next to the other caches; persistence is best effort"""
+    try:
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(f"{tmp}.npz", 'wb') as f:
+            sparse.save_npz(f, matrix)
+        with open(f"{tmp}.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                'vocabulary': {term: int(column) for term, column in vectorizer.vocabulary_.items()},
+                'idf': vectorizer.idf_.tolist(),
+                'refs': refs
+            }, f)
+        # Matrix first: a metadata file is only present once its matrix is complete
+        os.replace(f"{tmp}.npz", f"{path}.npz")
+        os.replace(f"{tmp}.json", f"{path}.json")
+    except OSError:
+        return
+    prune_tfidf_indexes()
+
+@st.cache_resource(max_entries=8)
+def build_tfidf_index(doc_keys, _documents):
+    """
+    TF-IDF matrix over every sentence of the given documents, loaded from disk when
+    the same document set was indexed before.
+    doc_keys identifies the document set; returns None when there is nothing to index.
+    """
+    path = index_path(doc_keys)
+    index = load_tfidf_index(path)
+    if index is not None:
+        return index
+    
+    refs = []  # (document name, sentence) per matrix row
+    for doc in _documents:
+        for sentence in doc['sentences']:
+            if sentence.strip():
+                refs.append((doc['name'], sentence.strip()))
+    if not refs:
+        return None
+    
+    vectorizer = TfidfVectorizer(ngram_range=TFIDF_NGRAM_RANGE, lowercase=True)
+    try:
+        matrix = vectorizer.fit_transform([sentence for _, sentence in refs])
+    except ValueError:
+        return None  # no indexable terms
+    save_tfidf_index(path, vectorizer, matrix, refs)
+    return vectorizer, matrix, refs
+
+def search_documents(documents, query, top_k=3):
+    """Top sentences across all documents; TF-IDF ranked when scikit-learn is available"""
+    index = None
+    if SKLEARN_AVAILABLE:
+        index = build_tfidf_index(tuple((doc['name'], doc['hash']) for doc in documents), documents)
+    
+    if index is None:
+        # Substring fallback
+        all_sources = []
+        for doc in documents:
+            for result in simple_search(doc, query):
+                all_sources.append({
+                    'document': doc['name'],
+                    'text': result['sentence'],
+                    'relevance': result['relevance']
+                })
+        all_sources.sort(key=lambda x: x['relevance'], reverse=True)
+        return all_sources[:top_k]
+    
+    vectorizer, matrix, refs = index
+    scores = (matrix @ vectorizer.transform([query]).T).toarray().ravel()
+    matched = np.flatnonzero(scores)
+    if len(matched) > top_k:
+        matched = matched[np.argpartition(-scores[matched], top_k)[:top_k]]
+    matched = matched[np.argsort(-scores[matched], kind='stable')]
+    
+    return [{
+        'document': refs[i][0],
+        'text': refs[i][1],
+        'relevance': round(float(scores[i]), 3)
+    } for i in matched]
+
 def main():
     """Main application"""
     st.title("🤖 Simple QA Agent")
@@ -102,6 +249,10 @@ def main():
         st.session_state.documents = []
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'doc_hashes' not in st.session_state:
+        st.session_state.doc_hashes = set()  # content hashes of the documents added
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}  # uploader file id -> content hash
     
     # Sidebar for file upload
     st.sidebar.header("📁 Upload Documents")
@@ -115,20 +266,34 @@ def main():
     
     # Process uploaded files
     if uploaded_files:
+        # Same content under any name is added once; edited files with a known name are new
+        new_files = []
+        new_hashes = []
         for uploaded_file in uploaded_files:
-            if uploaded_file.name not in [doc['name'] for doc in st.session_state.documents]:
-                with st.spinner(f"Processing {uploaded_file.name}..."):
-                    text = extract_text_from_file(uploaded_file)
-                    
-                    document = {
-                        'name': uploaded_file.name,
-                        'text': text,
-                        'word_count': len(text.split()),
-                        'uploaded_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    
-                    st.session_state.documents.append(document)
-                    st.sidebar.success(f"✅ Added {uploaded_file.name}")
+            file_hash = upload_hash(uploaded_file)
+            if file_hash not in st.session_state.doc_hashes:
+                st.session_state.doc_hashes.add(file_hash)
+                new_files.append(uploaded_file)
+                new_hashes.append(file_hash)
+        
+        if new_files:
+            with st.spinner(f"Processing {len(new_files)} file(s)..."):
+                texts = extract_texts(new_files, new_hashes)
+            
+            for uploaded_file, file_hash, text in zip(new_files, new_hashes, texts):
+                sentences, sentences_lower = split_sentences(text)
+                document = {
+                    'name': uploaded_file.name,
+                    'text': text,
+                    'sentences': sentences,
+                    'sentences_lower': sentences_lower,
+                    'hash': file_hash,
+                    'word_count': len(text.split()),
+                    'uploaded_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                
+                st.session_state.documents.append(document)
+                st.sidebar.success(f"✅ Added {uploaded_file.name}")
     
     # Display documents
     st.sidebar.header("📚 Your Documents")
@@ -138,7 +303,8 @@ def main():
                 st.write(f"**Words:** {doc['word_count']:,}")
                 st.write(f"**Uploaded:** {doc['uploaded_at']}")
                 if st.button("🗑️ Remove", key=f"remove_{i}"):
-                    st.session_state.documents.pop(i)
+                    removed = st.session_state.documents.pop(i)
+                    st.session_state.doc_hashes.discard(removed['hash'])
                     st.rerun()
     else:
         st.sidebar.info("No documents uploaded yet")
@@ -181,20 +347,8 @@ def main():
         # Process question
         with st.chat_message("assistant"):
             with st.spinner("Searching documents..."):
-                # Simple search across all documents
-                all_sources = []
-                for doc in st.session_state.documents:
-                    results = simple_search(doc['text'], question)
-                    for result in results:
-                        all_sources.append({
-                            'document': doc['name'],
-                            'text': result['sentence'],
-                            'relevance': result['relevance']
-                        })
-                
-                # Sort by relevance
-                all_sources.sort(key=lambda x: x['relevance'], reverse=True)
-                top_sources = all_sources[:3]
+                # Search across all documents
+                top_sources = search_documents(st.session_state.documents, question)
                 
                 if top_sources:
                     # Generate simple answer
@@ -0,0 +1,48 @@
+"""
+Text extraction for uploaded documents
+Lives in its own module so worker processes can import it
+"""
+import os
+import io
+import PyPDF2
+import docx
+
+def extract_text_from_file(file_name, data):
+    """Extract text from the raw bytes of an uploaded file"""
+    try:
+        # Extract text based on file type; parsers read the bytes in memory
+        file_ext = os.path.splitext(file_name)[1].lower()
+
+        if file_ext == '.pdf':
+            return extract_pdf_text(io.BytesIO(data))
+        elif file_ext == '.txt':
+            return data.decode('utf-8', errors='replace')
+        elif file_ext in ['.docx', '.doc']:
+            return extract_docx_text(io.BytesIO(data))
+        else:
+            return "Unsupported file type"
+
+    except Exception as e:
+        return f"Error processing file: {str(e)}"
+
+def extract_pdf_text(stream):
+    """Extract text from a PDF file object"""
+    try:
+        text = ""
+        pdf_reader = PyPDF2.PdfReader(stream)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+        return text
+    except Exception as e:
+        return f"PDF extraction error: {str(e)}"
+
+def extract_docx_text(stream):
+    """Extract text from a DOCX file object"""
+    try:
+        doc = docx.Document(stream)
+        text = ""
+        for paragraph in doc.paragraphs:
+            text += paragraph.text + "\n"
+        return text
+    except Exception as e:
+        return f"DOCX extraction error: {str(e)}"
@@ -91,12 +91,9 @@ def search_in_documents(query, documents):
     query_lower = query.lower()
     
     for doc_id, doc in documents.items():
-        content_lower = doc['content'].lower()
-        
-        # Check if query is in content
-        if query_lower in content_lower:
-            # Find the position
-            start = content_lower.find(query_lower)
+        # Single scan of the lowercase text prepared when the document was added
+        start = doc['content_lower'].find(query_lower)
+        if start != -1:
             # Get context around the match
             context_start = max(0, start - 100)
             context_end = min(len(doc['content']), start + len(query) + 100)
@@ -131,17 +128,20 @@ def main():
                 # Extract text
                 content = extract_text_from_file(uploaded_file)
                 
+                word_count = len(content.split())
+                
                 # Add to documents
                 doc_id = f"doc_{len(st.session_state.documents)}"
                 st.session_state.documents[doc_id] = {
                     'name': uploaded_file.name,
                     'content': content,
-                    'word_count': len(content.split()),
+                    'content_lower': content.lower(),
+                    'word_count': word_count,
                     'added_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
                 
                 st.success(f"✅ Added {uploaded_file.name}")
-                st.info(f"📊 Extracted {len(content.split())} words")
+                st.info(f"📊 Extracted {word_count} words")
         
         # Show documents
         st.header("📋 Current Documents")
@@ -11,8 +11,11 @@ def run_frontend():
     """Run the Streamlit frontend"""
     print("🚀 Starting Frontend (Streamlit)...")
     os.chdir('frontend')
-    os.environ['STREAMLIT_BROWSER_GATHER_USAGE_STATS'] = 'false'
-    subprocess.run([sys.executable, '-m', 'streamlit', 'run', 'app.py', '--server.headless', 'true'])
+    # Streamlit runs in this interpreter rather than a second Python process
+    from streamlit.web import bootstrap
+    flag_options = {'server.headless': True, 'browser.gatherUsageStats': False}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run('app.py', False, [], flag_options)
 
 def run_backend():
     """Run the Flask backend API"""